@@ -0,0 +1,328 @@
+'''
+Created on 18.10.2026
+
+Benchmark of the image recognition hot path of :class:`ClientInterface.ClientInterface`.
+
+The packaged templates are pasted onto synthetic screens at several resolutions, then
+:func:`match`, :func:`locate`, :func:`isvisible` and :func:`waitforelement` are timed for
+every template, as well as ``mult=True`` matching on screens with many copies of a template
+and similar looking distractors. Usage::
+
+    python Benchmark.py --save ~/.ersTestSuite/benchmark.json
+    python Benchmark.py --compare ~/.ersTestSuite/benchmark.json --threshold 0.2
+
+With ``--compare`` the exit code is 1 if the median latency of any scenario got worse by more
+than the threshold (relative).
+'''
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import numpy as np
+import cv2
+from PIL import Image
+from Capture import CaptureBackend
+from ClientInterface import ClientInterface, MatchContext, Timeout, ElementError
+from Prefilter import Prefilter
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+resolutions = {'1080p': (1920, 1080), '1440p': (2560, 1440), '4k': (3840, 2160)}
+imagedir = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'images')
+
+
+class StaticBackend(CaptureBackend):
+  """A capture backend returning regions of a fixed image."""
+
+  def __init__(self, screen):
+    CaptureBackend.__init__(self)
+    self.screen = screen
+
+  def size(self):
+    return (self.screen.shape[1], self.screen.shape[0])
+
+  def grab(self, bbox=None):
+    (x, y, width, height) = self.clip(bbox)
+    self.generation += 1
+    return self.screen[y:y + height, x:x + width]
+
+
+class CountingContext(MatchContext):
+  """A :class:`ClientInterface.MatchContext` counting the positions of all correlation maps it
+  computes, on every pyramid level and in every window or tile.
+  """
+
+  def __init__(self):
+    MatchContext.__init__(self)
+    self.positions = 0
+
+  def correlate(self, name, source, template):
+    result = MatchContext.correlate(self, name, source, template)
+    self.positions += result.size
+    return result
+
+
+class BenchmarkInterface(ClientInterface):
+  """A :class:`ClientInterface.ClientInterface` on a synthetic screen, counting the number of
+  positions at which the correlation was computed in :attr:`area`.
+  """
+
+  def __init__(self, screen, **kwargs):
+    ClientInterface.__init__(self, capture=StaticBackend(screen), **kwargs)
+    self.imagedirs = [imagedir]
+    self.match_context = CountingContext()
+
+  def _init_gui(self):
+    pass
+
+  def _sleep(self, s):
+    pass
+
+  def size(self):
+    return self.capture.size()
+
+  @property
+  def area(self):
+    return self.match_context.positions
+
+  @area.setter
+  def area(self, positions):
+    self.match_context.positions = positions
+
+  def _correlate_parallel(self, source, target):
+    positions = self.match_context.positions
+    result = ClientInterface._correlate_parallel(self, source, target)
+    # the bands computed by the pool, unless it fell back to a serial correlation
+    self.match_context.positions = positions + result.size
+    return result
+
+
+def load_templates():
+  """:returns: All packaged templates as RGB arrays, by name."""
+  return dict((os.path.splitext(os.path.basename(f))[0], np.array(Image.open(f).convert('RGB')))
+              for f in sorted(glob.glob(os.path.join(imagedir, '*.png'))))
+
+
+def background(size, rs):
+  """:returns: A synthetic web page: light background with boxes, lines and text-like noise."""
+  (width, height) = size
+  screen = np.full((height, width, 3), 245, np.uint8)
+  screen[:90] = (60, 63, 70)  # browser chrome
+  for _ in range(width * height // 20000):
+    (x, y) = (rs.randint(0, width - 40), rs.randint(90, height - 20))
+    (w, h) = (rs.randint(40, 400), rs.randint(15, 120))
+    color = tuple(int(c) for c in rs.randint(150, 255, 3))
+    cv2.rectangle(screen, (x, y), (x + w, y + h), color, -1)
+    cv2.rectangle(screen, (x, y), (x + w, y + h), (180, 180, 180), 1)
+  for _ in range(width * height // 8000):
+    (x, y) = (rs.randint(0, width - 200), rs.randint(90, height - 10))
+    text = ''.join(chr(rs.randint(97, 123)) for _ in range(rs.randint(3, 20)))
+    cv2.putText(screen, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (40, 40, 40), 1)
+  return screen
+
+
+def layout(screen, templates, rs):
+  """Paste ``templates`` onto ``screen`` at random non-overlapping positions.
+
+  :returns: The centers of the pasted templates, by name.
+  """
+  (height, width) = screen.shape[:2]
+  occupied = np.zeros((height, width), bool)
+  positions = {}
+  for name, t in templates.items():
+    (th, tw) = t.shape[:2]
+    for _ in range(100):
+      (x, y) = (rs.randint(0, width - tw), rs.randint(90, height - th))
+      if not occupied[y:y + th, x:x + tw].any():
+        break
+    screen[y:y + th, x:x + tw] = t
+    occupied[max(0, y - 5):y + th + 5, max(0, x - 5):x + tw + 5] = True
+    positions[name] = (x + tw // 2, y + th // 2)
+  return positions
+
+
+def distractors(screen, template, count, rs):
+  """Paste ``count`` copies of ``template`` and as many slightly altered copies at non-overlapping
+  positions.
+  """
+  altered = [np.clip(template.astype(int) + rs.randint(-60, 60, template.shape), 0, 255).astype(np.uint8)
+             for _ in range(count)]
+  layout(screen, dict(enumerate([template] * count + altered)), rs)
+
+
+def _close(p, q, tolerance=2):
+  return abs(p[0] - q[0]) <= tolerance and abs(p[1] - q[1]) <= tolerance
+
+
+def _same(matches, expected, tolerance=1e-4):
+  return (len(matches) == len(expected) and
+          all(m.point == e.point and abs(m.conf - e.conf) < tolerance for m, e in zip(matches, expected)))
+
+
+class Scenario(object):
+  """Collects latencies, allocations and correlated positions of one kind of call. Allocations
+  are measured with :mod:`tracemalloc`, which Python 2 does not have: they are ``None`` then.
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.latencies = []
+    self.allocations = []
+    self.areas = []
+    self.errors = 0
+
+  def measure(self, ci, call, check=None):
+    ci.area = 0
+    if tracemalloc is not None:
+      tracemalloc.start()
+    start = time.time()
+    failed = False
+    try:
+      r = call()
+    except Timeout:
+      r = None
+    except ElementError:
+      # a template which is on screen was not found
+      (r, failed) = (None, True)
+    elapsed = time.time() - start
+    if tracemalloc is not None:
+      self.allocations.append(tracemalloc.get_traced_memory()[1])
+      tracemalloc.stop()
+    self.latencies.append(elapsed)
+    self.areas.append(ci.area)
+    if failed or (check is not None and not check(r)):
+      self.errors += 1
+
+  def report(self):
+    lat = np.array(self.latencies) * 1000
+    r = dict(calls=len(lat), errors=self.errors,
+             p50_ms=float(np.percentile(lat, 50)), p90_ms=float(np.percentile(lat, 90)),
+             p99_ms=float(np.percentile(lat, 99)), mean_area=float(np.mean(self.areas)))
+    r['peak_alloc_kb'] = float(np.mean(self.allocations)) / 1024 if self.allocations else None
+    return r
+
+
+def _format(value):
+  return '{:.1f}'.format(value) if value is not None else 'n/a'
+
+
+def run(names, repeat=3, templates=None, seed=0, **settings):
+  """Run the benchmark on the resolutions ``names``.
+
+  :param settings: Attributes set on the interface, e.g. ``pyramid=2``.
+  :returns: The report of every scenario, by scenario name.
+  :rtype: dict
+  """
+  rs = np.random.RandomState(seed)
+  all_templates = load_templates()
+  if templates:
+    all_templates = dict((n, all_templates[n]) for n in templates)
+  # half of the templates is on screen, the other half is absent
+  names_sorted = sorted(all_templates)
+  present = dict((n, all_templates[n]) for n in names_sorted[::2])
+  absent = names_sorted[1::2]
+  reports = {}
+  for res in names:
+    size = resolutions[res]
+    screen = background(size, rs)
+    positions = layout(screen, present, rs)
+    ci = BenchmarkInterface(screen)
+    for key, value in settings.items():
+      setattr(ci, key, value)
+    scenarios = dict((op, Scenario('{}/{}'.format(res, op)))
+                     for op in ('match', 'locate', 'isvisible_absent', 'waitforelement'))
+    for _ in range(repeat):
+      for name in present:
+        found = lambda r: r is not None and _close(r, positions[name])
+        scenarios['match'].measure(ci, lambda: ci.match(name), lambda r: r and found(r[0].point))
+        scenarios['locate'].measure(ci, lambda: ci.locate(name), found)
+        scenarios['waitforelement'].measure(ci, lambda: ci.waitforelement(name, timeout=1)[1], found)
+      for name in absent:
+        # not checked: some absent templates are contained in present ones (e.g. amount_20 in amount_20,53)
+        scenarios['isvisible_absent'].measure(ci, lambda: ci.isvisible(name))
+    for (setting, scenario) in (('pyramid', 'pyramid_exact'), ('match_processes', 'parallel_exact')):
+      if settings.get(setting):
+        # pyramid matching and the pool have to find the matches of the default full search
+        exact = Scenario('{}/{}'.format(res, scenario))
+        reference = BenchmarkInterface(screen)
+        for name in names_sorted:
+          expected = reference.match(name)
+          exact.measure(ci, lambda: ci.match(name), lambda r: _same(r, expected))
+        scenarios[scenario] = exact
+    mult = Scenario('{}/mult'.format(res))
+    busy = background(size, rs)
+    distractors(busy, all_templates[names_sorted[0]], 25, rs)
+    ci.stop_tile_pool()
+    ci = BenchmarkInterface(busy)
+    for key, value in settings.items():
+      setattr(ci, key, value)
+    for _ in range(repeat):
+      for conf in (0.5, 0.8, 0.95):
+        mult.measure(ci, lambda: ci.match(names_sorted[0], mult=True, conf=conf), lambda r: len(r) >= 25)
+    ci.stop_tile_pool()
+    scenarios['mult'] = mult
+    for s in scenarios.values():
+      reports[s.name] = s.report()
+      logger.info('{:24} {}'.format(s.name, ', '.join('{}={}'.format(k, _format(v)) for k, v in sorted(reports[s.name].items()))))
+  return reports
+
+
+def compare(reports, baseline, threshold):
+  """:returns: The scenarios whose median latency is more than ``threshold`` (relative) worse
+  than in ``baseline``.
+  """
+  regressions = []
+  for name, r in sorted(reports.items()):
+    if name in baseline:
+      ratio = r['p50_ms'] / baseline[name]['p50_ms'] if baseline[name]['p50_ms'] else 1
+      if ratio > 1 + threshold:
+        regressions.append((name, baseline[name]['p50_ms'], r['p50_ms']))
+  return regressions
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark the image recognition of the ERS test suite.')
+  parser.add_argument('--resolutions', nargs='+', default=sorted(resolutions), choices=sorted(resolutions))
+  parser.add_argument('--templates', nargs='+', help='only use these templates')
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--pyramid', type=int, default=0)
+  parser.add_argument('--prefilter', action='store_true', help='reject searches with the prefilter')
+  parser.add_argument('--processes', type=int, default=0, help='correlate large areas on this many processes')
+  parser.add_argument('--save', help='save the results as baseline JSON')
+  parser.add_argument('--compare', help='compare with this baseline JSON')
+  parser.add_argument('--threshold', type=float, default=0.2)
+  args = parser.parse_args()
+  settings = dict(pyramid=args.pyramid, match_processes=args.processes)
+  if args.prefilter:
+    settings['prefilter'] = Prefilter()
+  reports = run(args.resolutions, repeat=args.repeat, templates=args.templates, **settings)
+  if args.prefilter:
+    logger.info('Prefilter: ' + settings['prefilter'].summary())
+  failed = [name for name, r in reports.items() if r['errors']]
+  for name in failed:
+    logger.error('{}: {} wrong results.'.format(name, reports[name]['errors']))
+  if args.save:
+    with open(os.path.expanduser(args.save), 'w') as f:
+      json.dump(reports, f, indent=1, sort_keys=True)
+  if args.compare:
+    with open(os.path.expanduser(args.compare)) as f:
+      regressions = compare(reports, json.load(f), args.threshold)
+    for (name, old, new) in regressions:
+      logger.error('{}: median {:.1f} ms -> {:.1f} ms.'.format(name, old, new))
+    failed += [name for (name, _, _) in regressions]
+  sys.exit(1 if failed else 0)
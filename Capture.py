@@ -0,0 +1,296 @@
+'''
+Created on 18.10.2026
+
+Screen capture backends for :class:`ClientInterface.ClientInterface`.
+'''
+
+import os
+import ctypes
+import ctypes.util
+import logging
+import struct
+import numpy as np
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+
+class CaptureError(Exception):
+  """This exception is raised if a capture backend is not available or fails.
+  """
+  pass
+
+
+class CaptureBackend(object):
+  """Base class of all capture backends.
+
+  :attr:`channels` is the channel order of the returned images (``'RGB'`` or ``'BGRA'``).
+  If :attr:`volatile` is ``True``, the returned array is a view into a buffer which is
+  overwritten by the next capture, :attr:`generation` is incremented on every capture so
+  that users of the buffer can detect this.
+  """
+  channels = 'RGB'
+  volatile = False
+
+  def __init__(self):
+    self.generation = 0
+
+  def size(self):
+    """:returns: Width and height of the screen."""
+    raise NotImplementedError
+
+  def grab(self, bbox=None):
+    """Capture the screen region ``bbox`` (inclusive coordinates) or the full screen.
+
+    :rtype: :class:`numpy.ndarray`
+    """
+    raise NotImplementedError
+
+  def close(self):
+    pass
+
+  def clip(self, bbox):
+    """:returns: ``x, y, width, height`` of ``bbox`` clipped to the screen."""
+    (width, height) = self.size()
+    if bbox is None:
+      return 0, 0, width, height
+    x1 = min(max(int(bbox[0]), 0), width - 1)
+    y1 = min(max(int(bbox[1]), 0), height - 1)
+    x2 = min(max(int(bbox[2]), x1), width - 1)
+    y2 = min(max(int(bbox[3]), y1), height - 1)
+    return x1, y1, x2 - x1 + 1, y2 - y1 + 1
+
+
+class PyAutoGUIBackend(CaptureBackend):
+  """Capture through :func:`pyautogui.screenshot`. This works everywhere but is slow, on Linux
+  every screenshot is written to a file by scrot and decoded again.
+  """
+
+  def size(self):
+    import pyautogui
+    return pyautogui.size()
+
+  def grab(self, bbox=None):
+    import pyautogui
+    rect = self.clip(bbox) if not bbox is None else None
+    self.generation += 1
+    return np.asarray(pyautogui.screenshot(region=rect))
+
+
+class _XImage(ctypes.Structure):
+  # only the leading fields of XImage which we need, the structure is always accessed through a pointer
+  _fields_ = [('width', ctypes.c_int), ('height', ctypes.c_int), ('xoffset', ctypes.c_int),
+              ('format', ctypes.c_int), ('data', ctypes.c_void_p), ('byte_order', ctypes.c_int),
+              ('bitmap_unit', ctypes.c_int), ('bitmap_bit_order', ctypes.c_int),
+              ('bitmap_pad', ctypes.c_int), ('depth', ctypes.c_int),
+              ('bytes_per_line', ctypes.c_int), ('bits_per_pixel', ctypes.c_int)]
+
+
+class _XShmSegmentInfo(ctypes.Structure):
+  _fields_ = [('shmseg', ctypes.c_ulong), ('shmid', ctypes.c_int),
+              ('shmaddr', ctypes.c_void_p), ('readOnly', ctypes.c_int)]
+
+
+class XShmBackend(CaptureBackend):
+  """Capture through the X11 MIT-SHM extension. The X server copies the requested region
+  directly into a shared memory segment, which is returned as a numpy view without any
+  further copy. Segments are kept for the most recently used region sizes.
+
+  :param display: The X display, e.g. ``':1'``.
+  :type display: str
+  """
+  channels = 'BGRA'
+  volatile = True
+  _ZPixmap = 2
+  _IPC_PRIVATE = 0
+  _IPC_CREAT = 0o1000
+  _IPC_RMID = 0
+  _max_segments = 4
+
+  def __init__(self, display=None):
+    CaptureBackend.__init__(self)
+    try:
+      self._x = ctypes.cdll.LoadLibrary(ctypes.util.find_library('X11') or 'libX11.so.6')
+      self._xext = ctypes.cdll.LoadLibrary(ctypes.util.find_library('Xext') or 'libXext.so.6')
+      self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except OSError as e:
+      raise CaptureError('X11 libraries not available: {}'.format(e))
+    x, xext, libc = self._x, self._xext, self._libc
+    x.XOpenDisplay.restype = ctypes.c_void_p
+    x.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x.XDefaultScreen.argtypes = [ctypes.c_void_p]
+    x.XRootWindow.restype = ctypes.c_ulong
+    x.XRootWindow.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XDefaultVisual.restype = ctypes.c_void_p
+    x.XDefaultVisual.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XDefaultDepth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XDisplayWidth.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XDisplayHeight.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XSync.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    x.XFree.argtypes = [ctypes.c_void_p]
+    x.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    xext.XShmQueryExtension.argtypes = [ctypes.c_void_p]
+    xext.XShmCreateImage.restype = ctypes.POINTER(_XImage)
+    xext.XShmCreateImage.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int,
+                                     ctypes.c_char_p, ctypes.POINTER(_XShmSegmentInfo),
+                                     ctypes.c_uint, ctypes.c_uint]
+    xext.XShmAttach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmDetach.argtypes = [ctypes.c_void_p, ctypes.POINTER(_XShmSegmentInfo)]
+    xext.XShmGetImage.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(_XImage),
+                                  ctypes.c_int, ctypes.c_int, ctypes.c_ulong]
+    libc.shmget.argtypes = [ctypes.c_int, ctypes.c_size_t, ctypes.c_int]
+    libc.shmat.restype = ctypes.c_void_p
+    libc.shmat.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int]
+    libc.shmdt.argtypes = [ctypes.c_void_p]
+    libc.shmctl.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p]
+
+    name = display if display is not None else os.environ.get('DISPLAY', ':0')
+    self._dpy = x.XOpenDisplay(name.encode('ascii'))
+    if not self._dpy:
+      raise CaptureError('Cannot open display {}.'.format(name))
+    if not xext.XShmQueryExtension(self._dpy):
+      x.XCloseDisplay(self._dpy)
+      raise CaptureError('Display {} does not support MIT-SHM.'.format(name))
+    screen = x.XDefaultScreen(self._dpy)
+    self._root = x.XRootWindow(self._dpy, screen)
+    self._visual = x.XDefaultVisual(self._dpy, screen)
+    self._depth = x.XDefaultDepth(self._dpy, screen)
+    self._size = (x.XDisplayWidth(self._dpy, screen), x.XDisplayHeight(self._dpy, screen))
+    self._segments = []
+
+  def size(self):
+    return self._size
+
+  def _segment(self, width, height):
+    """:returns: A shared memory image of the given size, creating it if necessary."""
+    for i, seg in enumerate(self._segments):
+      if seg[0] == (width, height):
+        self._segments.insert(0, self._segments.pop(i))
+        return seg
+    info = _XShmSegmentInfo()
+    img = self._xext.XShmCreateImage(self._dpy, self._visual, self._depth, self._ZPixmap,
+                                     None, ctypes.byref(info), width, height)
+    if not img:
+      raise CaptureError('XShmCreateImage failed.')
+    bits_per_pixel = img.contents.bits_per_pixel
+    if bits_per_pixel != 32:
+      self._x.XFree(img)
+      raise CaptureError('Unsupported pixel format ({} bits per pixel).'.format(bits_per_pixel))
+    nbytes = img.contents.bytes_per_line * height
+    info.shmid = self._libc.shmget(self._IPC_PRIVATE, nbytes, self._IPC_CREAT | 0o600)
+    if info.shmid < 0:
+      self._x.XFree(img)
+      raise CaptureError('shmget failed: {}'.format(os.strerror(ctypes.get_errno())))
+    info.shmaddr = self._libc.shmat(info.shmid, None, 0)
+    img.contents.data = info.shmaddr
+    info.readOnly = 0
+    self._xext.XShmAttach(self._dpy, ctypes.byref(info))
+    self._x.XSync(self._dpy, 0)
+    # the segment is destroyed automatically once both sides have detached
+    self._libc.shmctl(info.shmid, self._IPC_RMID, None)
+    buf = (ctypes.c_ubyte * nbytes).from_address(info.shmaddr)
+    view = np.ctypeslib.as_array(buf).reshape(height, img.contents.bytes_per_line)
+    view = view[:, :width * 4].reshape(height, width, 4)
+    seg = ((width, height), img, info, view)
+    self._segments.insert(0, seg)
+    while len(self._segments) > self._max_segments:
+      self._release(self._segments.pop())
+    return seg
+
+  def _release(self, seg):
+    (_, img, info, _) = seg
+    self._xext.XShmDetach(self._dpy, ctypes.byref(info))
+    self._libc.shmdt(info.shmaddr)
+    img.contents.data = None
+    self._x.XFree(img)
+
+  def grab(self, bbox=None):
+    (x, y, width, height) = self.clip(bbox)
+    (_, img, _, view) = self._segment(width, height)
+    if not self._xext.XShmGetImage(self._dpy, self._root, img, x, y, 0xFFFFFFFF):
+      raise CaptureError('XShmGetImage failed.')
+    self.generation += 1
+    return view
+
+  def close(self):
+    while self._segments:
+      self._release(self._segments.pop())
+    if self._dpy:
+      self._x.XCloseDisplay(self._dpy)
+      self._dpy = None
+
+
+class XvfbBackend(CaptureBackend):
+  """Read the screen directly from the framebuffer file of an ``Xvfb`` started with
+  ``-fbdir``. The file is memory mapped, so a region capture only touches the pixels inside
+  the region and the returned array is a view into the live framebuffer.
+
+  :param fbdir: The directory given to ``Xvfb -fbdir``.
+  :type fbdir: str
+  :param screen: The screen number.
+  :type screen: int
+  """
+  channels = 'BGRA'
+  volatile = True
+  _header = '>25I'
+
+  def __init__(self, fbdir, screen=0):
+    CaptureBackend.__init__(self)
+    filename = os.path.join(os.path.expanduser(fbdir), 'Xvfb_screen{}'.format(screen))
+    try:
+      with open(filename, 'rb') as f:
+        header = struct.unpack(self._header, f.read(struct.calcsize(self._header)))
+    except (IOError, OSError, struct.error) as e:
+      raise CaptureError('Cannot read framebuffer {}: {}'.format(filename, e))
+    # XWD file header, see X11/XWDFile.h
+    (header_size, _, _, _, width, height, _, byte_order, _, _, _, bits_per_pixel,
+     bytes_per_line, _, _, _, _, _, _, ncolors) = header[:20]
+    if bits_per_pixel != 32 or byte_order != 0:
+      raise CaptureError('Unsupported framebuffer format ({} bits per pixel, byte order {}).'.format(
+          bits_per_pixel, byte_order))
+    self._size = (width, height)
+    # the pixel data follows the header and the color map (12 bytes per entry)
+    fb = np.memmap(filename, dtype=np.uint8, mode='r', offset=header_size + 12 * ncolors,
+                   shape=(height, bytes_per_line))
+    self._fb = fb[:, :width * 4].reshape(height, width, 4)
+
+  def size(self):
+    return self._size
+
+  def grab(self, bbox=None):
+    (x, y, width, height) = self.clip(bbox)
+    self.generation += 1
+    return self._fb[y:y + height, x:x + width]
+
+
+def make_backend(name='auto', display=None, fbdir=None):
+  """Create the capture backend ``name``.
+
+  :param name: One of ``'auto'``, ``'xshm'``, ``'xvfb'`` or ``'pyautogui'``. ``'auto'`` uses the
+    framebuffer if ``fbdir`` is given, otherwise shared memory, and falls back to pyautogui.
+  :type name: str
+  :rtype: :class:`CaptureBackend`
+  """
+  if name == 'pyautogui':
+    return PyAutoGUIBackend()
+  if name == 'xshm':
+    return XShmBackend(display)
+  if name == 'xvfb':
+    if not fbdir:
+      raise CaptureError('The xvfb capture backend needs the option fbdir.')
+    return XvfbBackend(fbdir)
+  if name != 'auto':
+    raise CaptureError('Unknown capture backend {}.'.format(name))
+  candidates = [lambda: XvfbBackend(fbdir)] if fbdir else []
+  candidates.append(lambda: XShmBackend(display))
+  for candidate in candidates:
+    try:
+      return candidate()
+    except CaptureError as e:
+      logger.debug('{}, trying next capture backend.'.format(e))
+  return PyAutoGUIBackend()
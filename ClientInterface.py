@@ -9,8 +9,20 @@ import math
 import WaitForKey as key
 import os
 import logging
+import json
+import heapq
+import subprocess
+import threading
+import itertools
+from multiprocessing.pool import ThreadPool
 import numpy as np
 import cv2
+from collections import OrderedDict, defaultdict, deque
+import Capture
+import Instrumentation
+import TemplateBundle
+import Prefilter
+import TilePool
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -24,6 +36,9 @@ shortsleep=0.15
 longsleep = 0.9
 fastsleep = 0.03
 
+# time.monotonic is not available in Python 2
+monotonic = getattr(time, 'monotonic', time.time)
+
 class CalibrationError(Exception):
   """This exception is raised whenever an element that was expected is not found
   on screen during calibration.
@@ -61,6 +76,7 @@ class Match(object):
   Comparison of ``Match``-objects is implemented by comparing the confidence-values. Therefore
   we can conveniently sort a list of ``Match``-objects.
   """
+  __slots__ = ('conf', 'point')
 
   def __init__(self, c, p):
     self.conf = c
@@ -104,6 +120,8 @@ class BBox(tuple):
 
   We can add a :class:`Point` to a :class:`BBox` to give it an offset.
   """
+  __slots__ = ()
+
   def __new__(cls, x1, y1, x2, y2):
     return tuple.__new__(cls, (x1, y1, x2, y2))
 
@@ -141,6 +159,13 @@ class BBox(tuple):
   def height(self):
     return self[3] - self[1]
 
+  def union(self, other):
+    """:returns: The smallest bounding box containing both bounding boxes.
+    :rtype: :class:`BBox`
+    """
+    return BBox(min(self[0], other[0]), min(self[1], other[1]),
+                max(self[2], other[2]), max(self[3], other[3]))
+
   def center_vertically(self, pos):
     return BBox(self[0], pos - self.height / 2, self[2],
                 pos + (self.height - self.height / 2))
@@ -158,6 +183,8 @@ class Point(tuple):
 
       Point(x1,y1)*Point(x2,y2)==BBox(x1,y1,x2,y2)
   """
+  __slots__ = ()
+
   def __new__(cls, x, y):
     return tuple.__new__(cls, (x, y))
 
@@ -186,51 +213,663 @@ class Point(tuple):
   def distance(self, other):
     return math.sqrt((self[0] - other[0]) ** 2 + (self[1] - other[1]) ** 2)
 
+# Templates have always been converted with COLOR_BGR2GRAY although PIL delivers RGB. Frames
+# in other channel orders use the conversion which yields the same gray values.
+_gray_conversion = {'RGB': cv2.COLOR_BGR2GRAY, 'BGRA': cv2.COLOR_RGBA2GRAY}
+_rgb_conversion = {'RGB': None, 'BGRA': cv2.COLOR_BGRA2RGB}
+
+
+class Frame(object):
+  """A single screenshot which can be matched against several templates.
+
+  :param image: The captured image.
+  :type image: :class:`numpy.ndarray`
+  :param bbox: The screen region of the capture, or ``None`` for the full screen.
+  :type bbox: :class:`BBox`
+  :param channels: The channel order of ``image``, ``'RGB'`` or ``'BGRA'``.
+  :type channels: str
+  :param capture: The backend which captured ``image``, if ``image`` is a view into a buffer
+    of the backend which is reused by the next capture.
+  :type capture: :class:`Capture.CaptureBackend`
+  :param buffers: If given, the conversions are written to its buffers named ``buffer``, which
+    are reused by the next frame with the same buffer name and size.
+  :type buffers: :class:`MatchContext`
+
+  The grayscale and RGB versions of the image are computed once on first use and shared by all
+  matches performed on this frame. Frames taken by :func:`ClientInterface.snapshot` are numbered
+  (:attr:`sequence`) and remember when the capture started (:attr:`started`, monotonic clock).
+  """
+
+  def __init__(self, image, bbox=None, channels='RGB', capture=None, buffers=None, buffer='frame'):
+    self.image = np.asarray(image)
+    (height, width) = self.image.shape[:2]
+    offset = bbox.offset() if not bbox is None else Point(0, 0)
+    self.bbox = BBox(offset[0], offset[1], offset[0] + width - 1, offset[1] + height - 1)
+    self.channels = channels
+    self.timestamp = time.time()
+    self.sequence = None
+    self.started = None
+    self._capture = capture
+    self._buffers = buffers
+    self._buffer = buffer
+    self._generation = capture.generation if capture is not None else None
+    self._gray = None
+    self._rgb = self.image if _rgb_conversion[channels] is None else None
+
+  def _check_buffer(self):
+    if self._capture is not None and self._capture.generation != self._generation:
+      raise Capture.CaptureError('The capture buffer of this frame has been reused by a newer capture.')
+
+  def array(self, gray=True):
+    """:returns: The full image, converted to grayscale if ``gray`` is ``True``, otherwise in RGB.
+    :rtype: :class:`numpy.ndarray`
+    """
+    if gray:
+      if self._gray is None:
+        self._check_buffer()
+        self._gray = self._convert(_gray_conversion[self.channels], 'gray')
+      return self._gray
+    if self._rgb is None:
+      self._check_buffer()
+      self._rgb = self._convert(_rgb_conversion[self.channels], 'rgb')
+    return self._rgb
+
+  def _convert(self, code, kind):
+    if self._buffers is None:
+      return cv2.cvtColor(self.image, code)
+    return self._buffers.convert('{}.{}'.format(self._buffer, kind), self.image, code, gray=kind == 'gray')
+
+  def contains(self, bbox):
+    """:returns: ``True`` if ``bbox`` lies completely inside this frame."""
+    return (bbox[0] >= self.bbox[0] and bbox[1] >= self.bbox[1] and
+            bbox[2] <= self.bbox[2] and bbox[3] <= self.bbox[3])
+
+  def region(self, bbox=None, gray=True):
+    """Cut the part of the frame inside ``bbox`` (in screen coordinates).
+
+    :returns: The image region (a view, not a copy) and its upper left corner in screen coordinates.
+    :rtype: (:class:`numpy.ndarray`, :class:`Point`)
+    """
+    im = self.array(gray=gray)
+    if bbox is None:
+      return im, self.bbox.offset()
+    x1 = max(bbox[0], self.bbox[0])
+    y1 = max(bbox[1], self.bbox[1])
+    x2 = min(bbox[2], self.bbox[2])
+    y2 = min(bbox[3], self.bbox[3])
+    offset = Point(x1, y1)
+    rel = offset - self.bbox.offset()
+    return im[rel[1]:max(rel[1], y2 - self.bbox[1] + 1), rel[0]:max(rel[0], x2 - self.bbox[0] + 1)], offset
+
+
+class MatchContext(object):
+  """Preallocated buffers for the matching hot path, so that polling does not allocate new
+  images for every color conversion, pyramid level and correlation map. The buffers are passed
+  to OpenCV as destination arrays.
+
+  Buffers are kept per thread and keyed by name and type, each one grows to the largest shape
+  requested so far. A buffer is overwritten by the next call with the same name in the same
+  thread, so the result has to be used before that.
+
+  If :attr:`ipp` is ``False``, the correlations are computed without OpenCV's IPP code path, as
+  in the workers of a :class:`TilePool.TilePool`: slower, but with the same results as the pool.
+  """
+
+  def __init__(self):
+    self.allocations = 0
+    self.ipp = True
+    self._local = threading.local()
+    self._kernels = {}
+
+  def buffer(self, name, shape, dtype=np.uint8):
+    """:returns: A contiguous array of the given shape and type in the buffer ``name``.
+    :rtype: :class:`numpy.ndarray`
+    """
+    buffers = getattr(self._local, 'buffers', None)
+    if buffers is None:
+      buffers = self._local.buffers = {}
+    key = (name, np.dtype(dtype).str)
+    size = int(np.prod(shape))
+    buf = buffers.get(key)
+    if buf is None or buf.size < size:
+      buf = buffers[key] = np.empty(size, dtype)
+      self.allocations += 1
+    return buf[:size].reshape(shape)
+
+  def convert(self, name, image, code, gray):
+    """:returns: ``image`` converted with ``cv2.cvtColor`` to grayscale or three channels."""
+    shape = image.shape[:2] if gray else image.shape[:2] + (3,)
+    return cv2.cvtColor(image, code, dst=self.buffer(name, shape))
+
+  def correlate(self, name, source, template):
+    """:returns: The normalized correlation coefficient map of ``template`` in ``source``."""
+    shape = (source.shape[0] - template.shape[0] + 1, source.shape[1] - template.shape[1] + 1)
+    if getattr(self._local, 'ipp', True) != self.ipp:
+      # the IPP setting of OpenCV is per thread and on by default
+      TilePool.set_ipp(self.ipp)
+      self._local.ipp = self.ipp
+    return cv2.matchTemplate(source, template, cv2.TM_CCOEFF_NORMED,
+                             result=self.buffer(name, shape, np.float32))
+
+  def pyr_down(self, name, image):
+    """:returns: ``image`` downscaled by two with ``cv2.pyrDown``."""
+    shape = ((image.shape[0] + 1) // 2, (image.shape[1] + 1) // 2) + image.shape[2:]
+    return cv2.pyrDown(image, dst=self.buffer(name, shape, image.dtype), dstsize=(shape[1], shape[0]))
+
+  def dilate(self, name, image, size):
+    """:returns: ``image`` dilated with a rectangular kernel of ``size`` (width, height)."""
+    if size not in self._kernels:
+      self._kernels[size] = np.ones((size[1], size[0]), np.uint8)
+    return cv2.dilate(image, self._kernels[size], dst=self.buffer(name, image.shape, image.dtype))
+
+
+class CaptureThread(object):
+  """Captures frames in the background into a ring buffer while the caller is matching.
+
+  :param snapshot: Called with the region to capture, returns a :class:`Frame`.
+  :param region: The screen region to capture, ``None`` for the full screen.
+  :type region: :class:`BBox`
+  :param interval: Minimum time in seconds between two captures.
+  :param size: Number of frames kept in the ring buffer.
+  :param linger: Capturing pauses if no frame was requested for this many seconds.
+  """
+
+  def __init__(self, snapshot, region=None, interval=0.02, size=8, linger=1.):
+    self.snapshot = snapshot
+    self.region = region
+    self.interval = interval
+    self.linger = linger
+    self.frames = deque(maxlen=size)
+    self.error = None
+    self._demand = 0
+    self._stopped = False
+    self._condition = threading.Condition()
+    self._thread = threading.Thread(target=self._run, name='CaptureThread')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _run(self):
+    while True:
+      with self._condition:
+        while not self._stopped and monotonic() >= self._demand:
+          self._condition.wait()
+        if self._stopped:
+          return
+        region = self.region
+      start = monotonic()
+      try:
+        frame = self.snapshot(region)
+      except Exception as e:
+        with self._condition:
+          self.error = e
+          self._stopped = True
+          self._condition.notify_all()
+        return
+      with self._condition:
+        self.frames.append((region, frame))
+        self._condition.notify_all()
+      time.sleep(max(0, self.interval - (monotonic() - start)))
+
+  def widen(self, bbox):
+    """Make sure that the captured region contains ``bbox`` (``None`` is the full screen)."""
+    with self._condition:
+      if self.region is not None:
+        self.region = None if bbox is None else self.region.union(bbox)
+
+  def retarget(self, bbox):
+    """Capture ``bbox`` from now on, starting right away."""
+    with self._condition:
+      self.region = bbox
+      self._demand = max(self._demand, monotonic() + self.linger)
+      self._condition.notify_all()
+
+  def _covers(self, region, bbox):
+    return region is None or (bbox is not None and region.union(bbox) == region)
+
+  def newer(self, after=None, since=None, bbox=None, timeout=None):
+    """:returns: The newest frame containing ``bbox`` which is newer than frame number ``after``
+      and whose capture started after ``since`` (monotonic clock), or ``None`` after ``timeout``
+      seconds.
+    :rtype: :class:`Frame`
+    """
+    deadline = monotonic() + timeout if timeout is not None else None
+    with self._condition:
+      while True:
+        if self.error is not None:
+          raise self.error
+        self._demand = max(self._demand, monotonic() + self.linger)
+        self._condition.notify_all()
+        for (region, frame) in reversed(self.frames):
+          if after is not None and frame.sequence <= after:
+            break
+          if (since is None or frame.started >= since) and self._covers(region, bbox):
+            return frame
+        remaining = deadline - monotonic() if deadline is not None else self.linger
+        if remaining <= 0:
+          return None
+        self._condition.wait(min(remaining, self.linger))
+
+  def stop(self):
+    with self._condition:
+      self._stopped = True
+      self._condition.notify_all()
+    self._thread.join()
+
+
+class TemplateStore(object):
+  """In-memory cache of decoded template images.
+
+  :param imagedirs: Directories to search for templates, in order of precedence.
+  :type imagedirs: list
+  :param maxsize: Maximum number of templates to keep in memory (least recently used are evicted).
+  :type maxsize: int
+
+  Each template name is resolved once across ``imagedirs``. The decoded grayscale and color
+  arrays are kept in memory until the file's modification time changes or a file with the same
+  name appears in a directory with higher precedence, so screenshots can be replaced while a
+  session is running. If :attr:`bundle` is a :class:`TemplateBundle.TemplateBundle`, the arrays
+  are taken from it instead of decoding the file, unless the file is newer than the bundle.
+  """
+
+  def __init__(self, imagedirs=None, maxsize=128):
+    self.imagedirs = list(imagedirs) if imagedirs is not None else ['']
+    self.maxsize = maxsize
+    self.profiler = Instrumentation.profiler
+    self.bundle = None
+    self._cache = OrderedDict()
+    self._lock = threading.RLock()
+
+  def clear(self):
+    self._cache.clear()
+
+  def _filename(self, name):
+    return name if name.endswith('.png') else name + '.png'
+
+  def _mtime(self, path):
+    try:
+      return os.stat(path).st_mtime
+    except OSError:
+      return None
+
+  def _resolve(self, name):
+    """:returns: The index of the image directory and the full path of template ``name``.
+    :raises: :class:`IOError` if the template does not exist in any of the image directories.
+    """
+    filename = self._filename(name)
+    for i, d in enumerate(self.imagedirs):
+      path = os.path.join(d, filename)
+      if os.path.isfile(path):
+        return i, path
+    raise IOError('Could not load {} in {}.'.format(filename, ', '.join(self.imagedirs)))
+
+  def path(self, name):
+    """:returns: The full path of template ``name``."""
+    return self._resolve(name)[1]
+
+  def _stamp(self, index, path):
+    """The validity stamp of a cache entry: the mtime of the file itself and of all image
+    directories with higher precedence (adding a file to a directory changes its mtime).
+    """
+    return (self._mtime(path),) + tuple(self._mtime(d or os.curdir) for d in self.imagedirs[:index])
+
+  def _load(self, index, path, stamp):
+    if self.bundle is not None:
+      entry = self.bundle.get(os.path.splitext(os.path.basename(path))[0], path, stamp[0])
+      if entry is not None:
+        return entry
+    with self.profiler.span('decode'):
+      return TemplateBundle.decode(path)
+
+  def get(self, name, gray=True):
+    """:returns: The decoded template ``name``.
+    :rtype: :class:`numpy.ndarray`
+    """
+    with self._lock:
+      return self._get(name, gray)
+
+  def _get(self, name, gray):
+    entry = self._cache.get(name)
+    if entry is not None and self._stamp(entry['index'], entry['path']) != entry['stamp']:
+      logger.debug('Template {} changed on disk, reloading.'.format(name))
+      entry = None
+    if entry is None:
+      index, path = self._resolve(name)
+      stamp = self._stamp(index, path)
+      entry = self._load(index, path, stamp)
+      entry.update(index=index, path=path, stamp=stamp)
+      self._cache[name] = entry
+      while len(self._cache) > self.maxsize:
+        self._cache.popitem(last=False)
+    else:
+      # mark as most recently used
+      del self._cache[name]
+      self._cache[name] = entry
+    return entry['gray'] if gray else entry['color']
+
+  def pyramid(self, name, levels):
+    """:returns: The grayscale template ``name`` and ``levels`` successively halved versions of it.
+    :rtype: list
+    """
+    with self._lock:
+      gray = self._get(name, True)
+      entry = self._cache[name]
+      pyramid = entry.setdefault('pyramid', [gray])
+      while len(pyramid) <= levels:
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+      return pyramid[:levels + 1]
+
+  def pyramid_scores(self, name, levels):
+    """:returns: The :func:`TemplateBundle.pyramid_scores` of template ``name`` up to ``levels``.
+    :rtype: list
+    """
+    pyramid = self.pyramid(name, levels)
+    with self._lock:
+      entry = self._cache[name]
+      if len(entry.get('pyramid_scores', ())) <= levels:
+        entry['pyramid_scores'] = TemplateBundle.pyramid_scores(pyramid)
+      return entry['pyramid_scores'][:levels + 1]
+
+  def signature(self, name, bins=4):
+    """:returns: The :func:`Prefilter.signature` of the color template ``name``."""
+    with self._lock:
+      color = self._get(name, False)
+      entry = self._cache[name]
+      if entry.get('signature', (None,))[0] != bins:
+        entry['signature'] = (bins, Prefilter.signature(color, bins))
+      return entry['signature'][1]
+
+  def stats(self, name):
+    """:returns: The mean of the grayscale template ``name`` and its norm with the mean subtracted.
+    :rtype: dict
+    """
+    with self._lock:
+      gray = self._get(name, True)
+      entry = self._cache[name]
+      if 'stats' not in entry:
+        entry['stats'] = TemplateBundle.stats(gray)
+      return entry['stats']
+
+
+class LocationPriors(object):
+  """Remembers where templates were found last, so that :func:`ClientInterface.match` can
+  search a small region first. Positions are persisted in a JSON file, separately for every
+  ``key`` (which should identify the screen layout, e.g. screen size and calibration offset).
+
+  :param filename: The JSON file.
+  :type filename: str
+  :param key: The screen layout.
+  :type key: str
+  :param padding: The margin in pixels around the last known position which is searched first.
+  :type padding: int
+
+  Use :func:`load` to share one instance between all interfaces using the same file. The
+  number of hits per search stage and the searched area are counted for :func:`summary`.
+  """
+  _instances = {}
+  stages = ('prior', 'search', 'full', None)
+
+  def __init__(self, filename, key, padding=20):
+    self.filename = filename
+    self.key = key
+    self.padding = padding
+    self.stats = dict((stage, 0) for stage in self.stages)
+    self.area = 0
+    self.full_area = 0
+    self._lock = threading.Lock()
+    try:
+      with open(filename) as f:
+        self._data = json.load(f)
+    except (IOError, ValueError):
+      self._data = {}
+    self.positions = self._data.setdefault(key, {})
+
+  @classmethod
+  def load(cls, filename, key, **kwargs):
+    """:returns: The shared instance for ``filename`` and ``key``."""
+    if (filename, key) not in cls._instances:
+      cls._instances[(filename, key)] = cls(filename, key, **kwargs)
+    return cls._instances[(filename, key)]
+
+  def get(self, name):
+    """:returns: The last known position of template ``name`` or ``None``."""
+    pos = self.positions.get(name)
+    return Point(*pos) if pos is not None else None
+
+  def hit(self, name, stage, point, area, full_area):
+    """Record the result of a search.
+
+    :param stage: The stage which found the template, ``None`` if it was not found.
+    :param point: Where the template was found.
+    :param area: The number of pixels searched in all stages.
+    :param full_area: The number of pixels a search of the whole screen would have needed.
+    """
+    with self._lock:
+      self.stats[stage] += 1
+      self.area += area
+      self.full_area += full_area
+      if point is not None and self.get(name) != point:
+        self.positions[name] = list(point)
+        self.save()
+
+  def save(self):
+    try:
+      with open(self.filename, 'w') as f:
+        json.dump(self._data, f, indent=1, sort_keys=True)
+    except IOError as e:
+      logger.warning('Could not save location priors: {}'.format(e))
+
+  def summary(self):
+    """:returns: A one line report of the hit rates and the correlation area saved."""
+    total = sum(self.stats.values())
+    if not total:
+      return 'No searches.'
+    rates = ', '.join('{} {:.0%}'.format(stage or 'miss', float(self.stats[stage]) / total)
+                      for stage in self.stages)
+    saved = 1 - float(self.area) / self.full_area if self.full_area else 0
+    return '{} searches: {}; correlation area saved {:.0%}.'.format(total, rates, saved)
+
+
 class ClientInterface(object):
 
-  def __init__(self, display=':0', confidence=0.8):
-    global gui
+  def __init__(self, display=':0', confidence=0.8, capture='auto', fbdir=None):
     os.environ['DISPLAY'] = display
-    import pyautogui as gui
-    gui.FAILSAFE = False
+    self._init_gui()
+    if isinstance(capture, Capture.CaptureBackend):
+      self.capture = capture
+    else:
+      self.capture = Capture.make_backend(capture, display=display, fbdir=fbdir)
+    logger.debug('Using capture backend {}.'.format(type(self.capture).__name__))
+    self.templates = TemplateStore()
+    self.profiler = Instrumentation.profiler
     self.imagedirs = ['']
+    self.priors = None
+    self.prefilter = None
+    self.search_bbox = None
+    self.pyramid = 0
+    self.pyramid_min_size = 16
+    self.pyramid_slack = 0.2
+    self.match_threads = 4
+    self.parallel_min_area = 1 << 22
+    self.nms_distance = 0.5
+    self.poll_interval = 0.05
+    self.last_input = monotonic()
+    self.recorder = None
+    self.pacing = 'fixed'
+    self.input_mode = 'type'
+    self._clipboard_missing = False
+    self.watch_region = None
+    self._pacing_reference = None
+    self._latencies = defaultdict(lambda: deque(maxlen=20))
+    self._pool = None
+    self._tile_pool = None
+    self._tile_pool_lock = threading.Lock()
+    self.threaded_capture = True
+    self._capture_thread = None
+    self._capture_lock = threading.RLock()
+    self._sequence = itertools.count(1)
+    self.match_context = MatchContext()
+    self.match_processes = 0
     self.default_timeout = 10
     self.confidence = confidence
 
+  def _init_gui(self):
+    global gui
+    import pyautogui as gui
+    gui.FAILSAFE = False
+
+  @property
+  def profiler(self):
+    """The :class:`Instrumentation.Profiler` which records the time spent in the hot path, by
+    default the one of :mod:`Instrumentation` at construction time (which records nothing unless
+    :func:`Instrumentation.enable` was called).
+    """
+    return self._profiler
+
+  @profiler.setter
+  def profiler(self, profiler):
+    self._profiler = profiler
+    self.templates.profiler = profiler
+
+  @property
+  def imagedirs(self):
+    """The directories searched for templates, in order of precedence. Assigning a new
+    list clears the template cache.
+    """
+    return self.templates.imagedirs
+
+  @imagedirs.setter
+  def imagedirs(self, dirs):
+    self.templates.imagedirs = list(dirs)
+    self.templates.clear()
+
+  @property
+  def match_processes(self):
+    """The number of processes computing the correlation of searches in at least
+    :attr:`parallel_min_area` pixels, 0 to compute it in the calling thread. The confidences of
+    these searches differ slightly from those computed in one piece, see :mod:`TilePool`.
+    """
+    return self._match_processes
+
+  @match_processes.setter
+  def match_processes(self, processes):
+    self.stop_tile_pool()
+    self._match_processes = processes
+
 
   def _moveto(self, point, movesleep=shortsleep, smooth=False, offset=Point(0, 0)):
     newpoint = point + offset
-    gui.moveTo(newpoint[0], newpoint[1], 1 if smooth else 0, pause=movesleep)
+    gui.moveTo(newpoint[0], newpoint[1], 1 if smooth else 0, pause=0)
+    self._pause(movesleep)
 
 
+  def _input_event(self, kind, *args):
+    """Called before every input action which may change the screen. With adaptive
+    :attr:`pacing`, the next :func:`_pause` ends on the reaction to this input, actions which
+    are not followed by a pause have to reset :attr:`_pacing_reference`.
+
+    :param kind: The name of the input method, e.g. ``'click'`` or ``'keypress'``.
+    :param args: The arguments describing the input.
+    """
+    self.last_input = monotonic()
+    if self.recorder is not None:
+      self.recorder.input(kind, *args)
+    if self.pacing == 'adaptive':
+      self._pacing_reference = (kind, self._watch())
+
   def _mousedown(self, s=shortsleep):
-    gui.mouseDown(pause=s)
+    self._input_event('mousedown')
+    gui.mouseDown(pause=0)
+    self._pause(s)
 
   def _mouseup(self, s=shortsleep):
-    gui.mouseUp(pause=s)
+    self._input_event('mouseup')
+    gui.mouseUp(pause=0)
+    self._pause(s)
 
   def _click(self, clicksleep=longsleep, **kwargs):
-    gui.click(pause=clicksleep)
+    self._input_event('click')
+    gui.click(pause=0)
+    self._pause(clicksleep)
 
 
   def keypress(self, i, s=shortsleep, modifier=None):
+    self._input_event('keypress', i, modifier)
     if not modifier is None:
       gui.hotkey(modifier, i)
     else:
       gui.press(str(i))
-    time.sleep(s)
+    self._pause(s)
 
 
   def type_string(self, s, typesleep=shortsleep):
-    gui.typewrite(s, interval=typesleep)
+    self._input_event('type_string', s)
+    # there is no pause to end on the reaction to the first key, which would be timed from the
+    # start of typing
+    self._pacing_reference = None
+    with self.profiler.span('type'):
+      gui.typewrite(s, interval=typesleep)
 
 
+  def key_sequence(self, keys, s=shortsleep):
+    """Press several keys, e.g. ``['down'] * 8``. Unless :attr:`input_mode` is ``'type'``, the
+    keys are sent without pauses in between and there is only one pause of ``s`` seconds at the end.
+    """
+    keys = [str(k) for k in keys]
+    self._input_event('key_sequence', keys)
+    gui.press(keys, interval=s if self.input_mode == 'type' else 0, pause=0)
+    self._pause(s)
+
+  def paste_string(self, s, settle=shortsleep):
+    """Enter ``s`` by copying it to the X clipboard and pasting it with ctrl+v. If neither
+    ``xclip`` nor ``xsel`` is available, ``s`` is typed without pauses instead, and so are the
+    texts of later calls.
+    """
+    # bytes (a Python 2 str) are passed through, only text is encoded
+    data = s if isinstance(s, bytes) else s.encode('utf-8')
+    commands = [] if self._clipboard_missing else [['xclip', '-selection', 'clipboard'],
+                                                   ['xsel', '--clipboard', '--input']]
+    for cmd in commands:
+      try:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+      except OSError:
+        continue
+      p.communicate(data)
+      if p.returncode == 0:
+        self._input_event('paste_string', s)
+        gui.hotkey('ctrl', 'v')
+        self._pause(settle)
+        return
+    if not self._clipboard_missing:
+      logger.warning('Neither xclip nor xsel is available, typing instead of pasting.')
+      self._clipboard_missing = True
+    self.type_string(s, typesleep=0)
+    self._pause(settle)
+
+  def enter_text(self, s):
+    """Enter the text ``s`` into the focused field according to :attr:`input_mode`:
+    ``'type'`` types with a pause after every character, ``'fast'`` types without pauses and
+    ``'paste'`` uses :func:`paste_string`.
+    """
+    if self.input_mode == 'paste':
+      self.paste_string(s)
+    elif self.input_mode == 'fast':
+      self.type_string(s, typesleep=0)
+      self._pause(shortsleep)
+    else:
+      self.type_string(s)
+
   def _mark_all(self, spot):
     self._drag(spot, spot + Point(200, 0), smooth=True)
 
 
-  def clickto(self, point, wait=False, **kwargs):
-    if wait:
+  def clickto(self, point, wait=False, name=None, until=None, **kwargs):
+    """Click on the template ``point`` (or directly on ``point`` if it is a :class:`Point`).
+    ``name`` names the step and ``until`` is a template which is visible once the step is
+    complete, for subclasses which keep statistics, they are not used here.
+    """
+    if isinstance(point, Point):
+      pass
+    elif wait:
       _, point = self.waitforelement(point)
     else:
       point = self.locate(point)
@@ -243,6 +882,8 @@ class ClientInterface(object):
 
   def _drag(self, point1, point2, smooth=False, **kwargs):
     self._moveto(point1, smooth=smooth)
+    self._input_event('drag', point2)
+    self._pacing_reference = None
     gui.dragTo(point2[0], point2[1], 1 if smooth else 0)
 
 
@@ -256,24 +897,94 @@ class ClientInterface(object):
     """Wait for an element ``positive`` at most ``timeout`` seconds and
     raise :class:`Timeout`. Return `True` if `positive` was found or
     `False` if one of the elements in ``negative`` was found during that time.
+
+    The screen is polled every :attr:`poll_interval` seconds at first, the interval doubles
+    up to ``sleep`` seconds as long as the screen does not change. Matching is skipped for
+    ticks where the screen looks exactly like in the previous tick.
     """
     if timeout is None:
       timeout = self.default_timeout
-    while timeout > 0:
-      vis = ClientInterface.isvisible(self, positive, location=True, **kwargs)
-      if vis:
-        return (True, vis)
-      for n in negative:
-        if self.isvisible(n):
-          return (False, n)
-      time.sleep(sleep)
-      timeout -= sleep
+    deadline = monotonic() + timeout
+    region = kwargs.get('bbox') if not negative else None
+    interval = self.poll_interval
+    previous = None
+    while True:
+      # one capture per tick, shared by the positive and all negative checks
+      frame = self.snapshot(bbox=region, buffer='wait')
+      thumbnail = self._thumbnail(frame)
+      if previous is None or thumbnail.shape != previous.shape or (thumbnail != previous).any():
+        vis = ClientInterface.isvisible(self, positive, location=True, source=frame, **kwargs)
+        if vis:
+          return (True, vis)
+        for n in negative:
+          if self.isvisible(n, source=frame):
+            return (False, n)
+        if previous is not None:
+          # the screen is changing, keep polling fast
+          interval = self.poll_interval
+      previous = thumbnail
+      remaining = deadline - monotonic()
+      if remaining <= 0:
+        break
+      self._sleep(min(interval, remaining))
+      interval = min(2 * interval, sleep)
     raise Timeout("Timeout beim Warten auf Steuerelement: " + positive)
 
+  def wait_site_loaded(self, region=None, force=False):
+    """Wait until the application is ready for input, there is nothing to wait for here."""
+    pass
+
+  def _sleep(self, s):
+    """Sleep between two polls."""
+    with self.profiler.span('poll'):
+      time.sleep(s)
+
+  def _pause(self, s):
+    """Pause after an input action. With :attr:`pacing` ``'adaptive'``, return as soon as
+    :attr:`watch_region` has changed after the input, ``s`` is only the maximum. Moving the
+    mouse only pauses :data:`fastsleep` seconds in this mode.
+    """
+    with self.profiler.span('sleep'):
+      if self.pacing != 'adaptive':
+        time.sleep(s)
+      elif self._pacing_reference is None:
+        time.sleep(min(s, fastsleep))
+      else:
+        (kind, reference) = self._pacing_reference
+        self._pacing_reference = None
+        deadline = self.last_input + self.pacing_ceiling(kind, s)
+        while monotonic() < deadline:
+          current = self._watch()
+          if current.shape != reference.shape or (current != reference).any():
+            self._latencies[kind].append(monotonic() - self.last_input)
+            return
+          time.sleep(fastsleep)
+
+  def _watch(self):
+    """:returns: A thumbnail of :attr:`watch_region` to detect the reaction to an input."""
+    return self._thumbnail(self.snapshot(bbox=self.watch_region, buffer='watch'), factor=4)
+
+  def pacing_ceiling(self, kind, s):
+    """:returns: The maximum pause after input ``kind`` for adaptive pacing: ``s``, or less once
+    the latency history of ``kind`` shows that the screen reacts faster.
+    """
+    history = self._latencies[kind]
+    if len(history) < 5:
+      return s
+    return min(s, max(fastsleep, 1.5 * max(history)))
+
+  def _thumbnail(self, frame, factor=8):
+    """:returns: A downsampled grayscale copy of ``frame`` used to detect screen changes cheaply."""
+    im = frame.array(gray=True)
+    size = (max(1, im.shape[1] // factor), max(1, im.shape[0] // factor))
+    return cv2.resize(im, size, interpolation=cv2.INTER_AREA)
+
   def _imreadRGB(self, filename):
     return gui.Image.open(filename, 'r')
 
   def _imwriteRGB(self, filename, im):
+    if isinstance(im, np.ndarray):
+      im = gui.Image.fromarray(im)
     im.save(filename)
 
   def grab(self, delay=0, bbox=None):
@@ -289,63 +1000,460 @@ class ClientInterface(object):
     for i in range(1, delay):
       print(str(i) + "..")
       time.sleep(1)
-    rect = tuple(bbox[0:2]) + (bbox[2] - bbox[0] + 1, bbox[3] - bbox[1] + 1) if not bbox is None else None
-    return gui.screenshot(region=rect)
+    with self._capture_lock:
+      # the colour conversion of a volatile frame must happen before the next capture
+      return self.snapshot(bbox=bbox).array(gray=False)
+
+  def snapshot(self, delay=0, bbox=None, buffer=None):
+    """Grab the screen once, the result can be passed as ``source`` to :func:`match`,
+    :func:`locate` and :func:`isvisible` for any number of templates.
+
+    :param bbox: Bounding box, or ``None`` for the full screen.
+    :type bbox: :class:`BBox`
+    :param buffer: Convert the frame into the :attr:`match_context` buffers of this name. The
+      frame is then only valid until the next snapshot with the same buffer and size.
+    :type buffer: str
+    :rtype: :class:`Frame`
+    """
+    for i in range(1, delay):
+      print(str(i) + "..")
+      time.sleep(1)
+    if not bbox is None:
+      (x, y, width, height) = self.capture.clip(bbox)
+      bbox = BBox(x, y, x + width - 1, y + height - 1)
+    with self._capture_lock:
+      with self.profiler.span('capture'):
+        started = monotonic()
+        image = self.capture.grab(bbox=bbox)
+        frame = Frame(image, bbox, channels=self.capture.channels,
+                      capture=self.capture if self.capture.volatile else None,
+                      buffers=self.match_context if buffer is not None else None, buffer=buffer)
+        frame.sequence = next(self._sequence)
+        frame.started = started
+        if self.capture.volatile:
+          # convert right away, the buffer is overwritten by the next capture
+          frame.array(gray=True)
+      if self.recorder is not None:
+        # still under the lock: the frame must be valid and the frames recorded in order
+        self.recorder.frame(frame)
+    return frame
 
   def _pil_to_numpy(self, pic, gray=True):
-    result = np.array(pic)
+    result = np.asarray(pic)
     return cv2.cvtColor(result, cv2.COLOR_BGR2GRAY) if gray else result
 
-  def match(self, target, source=None, bbox=None, conf=None, mult=False, gray=True):
+  def match(self, target, source=None, bbox=None, conf=None, mult=False, gray=True, min_distance=None, top=None):
     """Image recognition: find ``target`` in ``source``. Unfortunately, the implementation of
     pyautogui is incredibly slow :(
    
-    :param source: Image to search in.
-    :type source: :class:`numpy.ndarray`
+    :param source: Image to search in. If it is a :class:`Frame`, only the part inside ``bbox`` is
+      searched, otherwise a new screenshot of ``bbox`` is taken if ``source`` is ``None``.
+    :type source: :class:`Frame` or :class:`numpy.ndarray`
     :param target: Template to search for.
     :type target: :class:`numpy.ndarray`
     :param conf: Minimum confidence for a match (between 0 and 1)
     :type conf: float
     :param mult: Allow multiple matches. If False, only return the match with maximum confidence.
     :type mult: bool
-    :returns: A list of :class:`Match` objects. 
+    :param min_distance: For ``mult``: minimum horizontal and vertical distance in pixels between two
+      matches, the default is :attr:`nms_distance` times the template size.
+    :type min_distance: (int, int)
+    :param top: For ``mult``: return at most this many matches.
+    :type top: int
+    :returns: A list of :class:`Match` objects, or a list of such lists if ``target`` is a list.
     """
     if conf is None: conf = self.confidence
+    if type(target) == list:
+      return self._match_list(target, source=source, bbox=bbox, conf=conf, mult=mult, gray=gray,
+                              min_distance=min_distance, top=top)
+    with self.profiler.tag(template=target if type(target) is str else None):
+      if (self.priors is not None and type(target) is str and bbox is None and not mult
+          and (source is None or isinstance(source, Frame))):
+        return self._match_with_priors(target, source, conf, gray)
+      return self._match(target, source, bbox, conf, mult, gray, min_distance, top)[0]
+
+  def _match(self, target, source, bbox, conf, mult, gray, min_distance=None, top=None):
+    """The implementation of :func:`match` for a single template.
+
+    :returns: The sorted list of :class:`Match` objects and the number of pixels searched.
+    """
     offset = bbox.offset() if not bbox is None else Point(0, 0)
     r = []
-    if type(target) == list:
-      for t in target:
-        r.append(self.match(source, t, conf, mult))
-      return r
     if source is None:
-      source = self.grab(bbox=bbox)
-    if type(target) is str:
-      if not target.endswith('.png'):
-        target = target + '.png'
-      for d in self.imagedirs:
-        try:
-          target = self._imreadRGB(os.path.join(d, target))
-          break
-        except IOError:
-          pass
-    if type(target) is str:
-      raise IOError('Could not load {} in {}.'.format(target, ', '.join(self.imagedirs)))
-    source = self._pil_to_numpy(source, gray=gray)
-    target = self._pil_to_numpy(target, gray=gray)
+      source = self.snapshot(bbox=bbox, buffer='match')
+    raw = source
+    if isinstance(source, Frame):
+      source, offset = source.region(bbox, gray=gray)
+    else:
+      source = self._pil_to_numpy(source, gray=gray)
+    name = target if type(target) is str else None
+    if name is not None:
+      target = self.templates.get(name, gray=gray)
+    else:
+      target = self._pil_to_numpy(target, gray=gray)
     (t_height, t_width) = target.shape[:2]
-    result = cv2.matchTemplate(source, target, cv2.TM_CCOEFF_NORMED)
+    area = source.shape[0] * source.shape[1]
+    if source.shape[0] < t_height or source.shape[1] < t_width:
+      return r, area
+    levels = self._pyramid_levels(target, name, conf) if gray and not mult else 0
+    ranges = None
+    if self.prefilter is not None and name is not None:
+      with self.profiler.span('prefilter'):
+        ranges = self._prefilter(name, raw, bbox, source, target, gray, levels)
+      if ranges == []:
+        return r, area
+    if levels:
+      pyramid = self.templates.pyramid(name, levels) if name is not None else None
+      with self.profiler.span('correlate'):
+        r = self._match_pyramid(source, target, levels, conf, mult, pyramid)
+      if r:
+        r = [Match(c, p + offset) for (c, p) in r]
+        return sorted(r, key=lambda r: r.conf, reverse=True)[:top], area
+      # the template may be on screen although it was no candidate on the coarse level
+    with self.profiler.span('correlate'):
+      if ranges is not None:
+        result = self._correlate_ranges(source, target, ranges)
+      elif self.match_processes and area >= self.parallel_min_area:
+        result = self._correlate_parallel(source, target)
+      else:
+        result = self.match_context.correlate('result', source, target)
     if mult:
-      match_indices = np.arange(result.size)[(result > conf).flatten()]
-      for i in match_indices:
-        (y, x) = np.unravel_index(i, result.shape)
-        r.append(
-            Match(result[y, x], Point(int(x + t_width / 2), int(y + t_height / 2)) + offset))
+      if min_distance is None:
+        min_distance = (int(t_width * self.nms_distance), int(t_height * self.nms_distance))
+      for (c, x, y) in self._peaks(result, conf, min_distance, top):
+        r.append(Match(c, Point(int(x + t_width / 2), int(y + t_height / 2)) + offset))
     else:
       (_, maxVal, _, maxLoc) = cv2.minMaxLoc(result)
       if maxVal >= conf:
         r.append(
             Match(maxVal, Point(int(maxLoc[0] + t_width / 2), int(maxLoc[1] + t_height / 2)) + offset))
-    return sorted(r, key=lambda r: r.conf, reverse=True)
+    return sorted(r, key=lambda r: r.conf, reverse=True), area
+
+  def _prefilter(self, name, raw, bbox, source, target, gray, levels):
+    """Apply :attr:`prefilter` to the search for template ``name`` in ``source`` and count the
+    outcome. The signature test needs the color image: the :class:`Frame` or array ``raw``.
+
+    :returns: ``[]`` if the search is rejected, otherwise the ranges of the correlation map which
+      have to be computed, ``None`` for all of it.
+    """
+    positions = (source.shape[0] - target.shape[0] + 1) * (source.shape[1] - target.shape[1] + 1)
+    if self.prefilter.coverage <= 0:
+      # no signature test, the color image is not needed
+      (frame, color) = (None, None)
+    elif isinstance(raw, Frame):
+      (frame, color) = (raw, None)
+      try:
+        # the color image of a volatile frame is converted on demand, no capture may reuse the
+        # buffer meanwhile
+        with self._capture_lock:
+          color = raw.region(bbox, gray=False)[0]
+      except Capture.CaptureError:
+        # the frame has been captured over since, only the contrast test is applied
+        pass
+    else:
+      (frame, color) = (None, raw if isinstance(raw, np.ndarray) and raw.ndim == 3 else None)
+    if color is not None and color.size and not self.prefilter.check_signature(
+        self.templates.signature(name, self.prefilter.bins), color, frame, bbox):
+      self.prefilter.record('signature', positions, 0)
+      return []
+    ranges = None
+    if gray and not levels:
+      ranges = self.prefilter.candidates(source, target, self.templates.stats(name), self.match_context)
+    if ranges == []:
+      self.prefilter.record('contrast', positions, 0)
+    else:
+      correlated = sum((y2 - y1) * (x2 - x1) for (y1, y2, x1, x2) in ranges) if ranges is not None else positions
+      self.prefilter.record(None, positions, correlated)
+    return ranges
+
+  def _correlate_ranges(self, source, target, ranges):
+    """:returns: The correlation map of ``target`` in ``source``, computed only in ``ranges``
+      (see :func:`Prefilter.Prefilter.candidates`) and -1 elsewhere.
+    """
+    (t_height, t_width) = target.shape[:2]
+    shape = (source.shape[0] - t_height + 1, source.shape[1] - t_width + 1)
+    result = self.match_context.buffer('result', shape, np.float32)
+    result.fill(-1)
+    for (y1, y2, x1, x2) in ranges:
+      window = source[y1:y2 + t_height - 1, x1:x2 + t_width - 1]
+      result[y1:y2, x1:x2] = self.match_context.correlate('tile', window, target)
+    return result
+
+  def _correlate_parallel(self, source, target):
+    """:returns: The correlation map of ``target`` in ``source``, computed in bands on the
+      :class:`TilePool.TilePool` of :attr:`match_processes` processes.
+    """
+    with self._tile_pool_lock:
+      # searches on the match_many threads may start the pool at the same time
+      if self._tile_pool is None:
+        (width, height) = self.size()
+        self._tile_pool = TilePool.TilePool(self.match_processes, width * height)
+    shape = (source.shape[0] - target.shape[0] + 1, source.shape[1] - target.shape[1] + 1)
+    result = self._tile_pool.correlate(source, target, self.match_context.buffer('result', shape, np.float32))
+    if result is None:
+      result = self.match_context.correlate('result', source, target)
+    return result
+
+  def stop_tile_pool(self):
+    with self._tile_pool_lock:
+      if self._tile_pool is not None:
+        self._tile_pool.close()
+        self._tile_pool = None
+
+  def _peaks(self, result, conf, min_distance, top=None):
+    """Find the local maxima above ``conf`` in a correlation map with non-maximum suppression:
+    two returned peaks are at least ``min_distance`` apart in x or y.
+
+    :returns: A list of ``(confidence, x, y)``, sorted by decreasing confidence.
+    """
+    (dx, dy) = (max(1, min_distance[0]), max(1, min_distance[1]))
+    # a pixel is a candidate if it is the maximum of its neighbourhood
+    context = self.match_context
+    dilated = context.dilate('dilated', result, (2 * dx + 1, 2 * dy + 1))
+    candidates = np.greater(result, conf, out=context.buffer('above', result.shape, bool))
+    candidates &= np.greater_equal(result, dilated, out=context.buffer('maximum', result.shape, bool))
+    (ys, xs) = np.nonzero(candidates)
+    if not len(ys):
+      return []
+    vals = result[ys, xs]
+    if top:
+      # plateaus can yield several candidates for one peak, keep some reserve for suppression
+      order = heapq.nlargest(4 * top, range(len(vals)), key=vals.__getitem__)
+    else:
+      order = np.argsort(-vals, kind='mergesort')
+    # kept peaks on a grid of dx * dy cells: a cell holds at most one, and a candidate can only
+    # conflict with the peaks in its own and the eight neighbouring cells
+    kept = []
+    cells = {}
+    for i in order:
+      (x, y) = (int(xs[i]), int(ys[i]))
+      (cx, cy) = (x // dx, y // dy)
+      if all(abs(x - cells[c][0]) > dx or abs(y - cells[c][1]) > dy
+             for c in ((cx + u, cy + v) for u in (-1, 0, 1) for v in (-1, 0, 1)) if c in cells):
+        cells[(cx, cy)] = (x, y)
+        kept.append((float(vals[i]), x, y))
+        if top and len(kept) >= top:
+          break
+    return kept
+
+  def _pyramid_levels(self, template, name=None, conf=None):
+    """:returns: The number of pyramid levels usable for ``template``, 0 if pyramid matching is
+    off or the template would become smaller than :attr:`pyramid_min_size`. For a template
+    ``name``, levels on which the template is not recognised with ``conf`` minus
+    :attr:`pyramid_slack` are not used (see :func:`TemplateBundle.pyramid_scores`).
+    """
+    levels = 0
+    while levels < self.pyramid and (min(template.shape[:2]) >> (levels + 1)) >= self.pyramid_min_size:
+      levels += 1
+    if levels and name is not None and conf is not None:
+      scores = self.templates.pyramid_scores(name, levels)
+      while levels and scores[levels] < conf - self.pyramid_slack:
+        levels -= 1
+    return levels
+
+  def _match_pyramid(self, source, template, levels, conf, mult, pyramid=None, candidates=5, slack=None):
+    """Coarse-to-fine matching: find up to ``candidates`` positions on the downscaled source and
+    template, then compute the exact correlation at full resolution in a small neighbourhood of
+    each. The returned confidences are therefore the same as for a full search.
+
+    :param pyramid: Precomputed template pyramid, computed here if ``None``.
+    :param slack: How much lower than ``conf`` the coarse correlation may be for a candidate,
+      default :attr:`pyramid_slack`.
+    :returns: A list of ``(confidence, Point)`` pairs, relative to ``source``.
+    """
+    if slack is None:
+      slack = self.pyramid_slack
+    if pyramid is None:
+      pyramid = [template]
+      for _ in range(levels):
+        pyramid.append(cv2.pyrDown(pyramid[-1]))
+    small = source
+    for level in range(levels):
+      small = self.match_context.pyr_down('level{}'.format(level + 1), small)
+    (t_height, t_width) = template.shape[:2]
+    coarse = pyramid[levels]
+    if small.shape[0] < coarse.shape[0] or small.shape[1] < coarse.shape[1]:
+      return []
+    result = self.match_context.correlate('coarse', small, coarse)
+    scale = 1 << levels
+    margin = scale + 2
+    (c_height, c_width) = coarse.shape[:2]
+    r = []
+    for _ in range(candidates if not mult else 20 * candidates):
+      (_, coarseVal, _, (cx, cy)) = cv2.minMaxLoc(result)
+      if coarseVal < conf - slack:
+        break
+      # suppress this candidate on the coarse level
+      result[max(0, cy - c_height // 2):cy + c_height // 2 + 1, max(0, cx - c_width // 2):cx + c_width // 2 + 1] = -1
+      x0 = max(0, cx * scale - margin)
+      y0 = max(0, cy * scale - margin)
+      window = source[y0:cy * scale + margin + t_height, x0:cx * scale + margin + t_width]
+      if window.shape[0] < t_height or window.shape[1] < t_width:
+        continue
+      (_, maxVal, _, maxLoc) = cv2.minMaxLoc(self.match_context.correlate('window', window, template))
+      if maxVal >= conf:
+        r.append((maxVal, Point(int(x0 + maxLoc[0] + t_width / 2), int(y0 + maxLoc[1] + t_height / 2))))
+    if not mult:
+      r = sorted(r, reverse=True)[:1]
+    return r
+
+  def expected_region(self, name):
+    """:returns: The region around the last known position of template ``name``, or ``None``
+    if it is unknown.
+    :rtype: :class:`BBox`
+    """
+    last = self.priors.get(name) if self.priors is not None and type(name) is str else None
+    if last is None:
+      return None
+    (t_height, t_width) = self.templates.get(name).shape[:2]
+    pad = self.priors.padding
+    return BBox(last[0] - t_width // 2 - pad, last[1] - t_height // 2 - pad,
+                last[0] + t_width // 2 + pad, last[1] + t_height // 2 + pad)
+
+  def _match_with_priors(self, target, source, conf, gray):
+    """Search ``target`` around its last known position first, then inside :attr:`search_bbox`
+    and only then on the whole screen (or ``source``).
+    """
+    stages = []
+    expected = self.expected_region(target)
+    if expected is not None:
+      stages.append(('prior', expected))
+    if self.search_bbox is not None:
+      stages.append(('search', self.search_bbox))
+    stages.append(('full', None))
+    if isinstance(source, Frame):
+      full_area = source.bbox.width * source.bbox.height
+    else:
+      (width, height) = self.size()
+      full_area = width * height
+    area = 0
+    for stage, bbox in stages:
+      r, a = self._match(target, source, bbox, conf, False, gray)
+      area += a
+      if r:
+        self.priors.hit(target, stage, r[0].point, area, full_area)
+        return r
+    self.priors.hit(target, None, None, area, full_area)
+    return r
+
+  def _thread_pool(self):
+    if self._pool is None:
+      self._pool = ThreadPool(self.match_threads)
+    return self._pool
+
+  def _match_list(self, targets, source=None, bbox=None, gray=True, **kwargs):
+    if source is None:
+      source = self.snapshot(bbox=bbox, buffer='match_list')
+    if isinstance(source, Frame):
+      # convert once before the frame is shared between threads
+      source.array(gray=gray)
+    for t in targets:
+      if type(t) is str:
+        self.templates.get(t, gray=gray)
+    if len(targets) < 2 or self.match_threads < 2:
+      return [self.match(t, source=source, bbox=bbox, gray=gray, **kwargs) for t in targets]
+    # tags are kept per thread, the pool threads record their spans under the caller's tags
+    tags = self.profiler.current_tags()
+
+    def call(t):
+      with self.profiler.tag(**tags):
+        return self.match(t, source=source, bbox=bbox, gray=gray, **kwargs)
+    # cv2.matchTemplate releases the GIL, so the correlations run concurrently
+    return self._thread_pool().map(call, targets)
+
+  def match_many(self, targets, source=None, bbox=None, conf=None, mult=False, gray=True):
+    """Image recognition for several templates in one screenshot. The templates are matched
+    concurrently on a pool of :attr:`match_threads` threads.
+
+    :param targets: The names of the templates.
+    :type targets: list
+    :returns: A dictionary mapping each template name to its sorted list of :class:`Match` objects.
+    :rtype: dict
+
+    The other parameters are the same as for :func:`match`.
+    """
+    return dict(zip(targets, self.match(list(targets), source=source, bbox=bbox, conf=conf,
+                                        mult=mult, gray=gray)))
+
+  def whichvisible(self, ims, **kwargs):
+    """:returns: Those of the templates ``ims`` which are visible in one screenshot, in the given order.
+    :rtype: list
+    """
+    found = self.match_many(ims, **kwargs)
+    return [im for im in ims if found[im]]
+
+  def _background_snapshot(self, bbox):
+    with self._capture_lock:
+      frame = self.snapshot(bbox=bbox)
+      if self.capture.volatile:
+        frame.array(gray=False)
+    return frame
+
+  def capture_thread(self, bbox=None):
+    """:returns: The background :class:`CaptureThread`, started if necessary and capturing at
+      least ``bbox``. A thread which stopped on a capture error is replaced.
+    """
+    if self._capture_thread is not None and self._capture_thread.error is not None:
+      logger.warning('Restarting the capture thread after: {}'.format(self._capture_thread.error))
+      self._capture_thread = None
+    if self._capture_thread is None:
+      self._capture_thread = CaptureThread(self._background_snapshot, region=bbox,
+                                           interval=self.poll_interval)
+    else:
+      self._capture_thread.widen(bbox)
+    return self._capture_thread
+
+  def stop_capture_thread(self):
+    if self._capture_thread is not None:
+      self._capture_thread.stop()
+      self._capture_thread = None
+
+  def _next_frame(self, after, since, bbox, deadline):
+    """:returns: A frame newer than frame number ``after`` and captured after ``since``, from
+      the background capture thread if :attr:`threaded_capture` is on; ``None`` at the deadline.
+    """
+    if self.threaded_capture:
+      return self.capture_thread(bbox).newer(after, since, bbox, timeout=max(0, deadline - monotonic()))
+    if after is not None:
+      self._sleep(min(self.poll_interval, max(0, deadline - monotonic())))
+    return self.snapshot(bbox=bbox, buffer='wait_any')
+
+  def _wait_visible(self, templates, complete, timeout, bbox, since, **kwargs):
+    if timeout is None:
+      timeout = self.default_timeout
+    if since is None:
+      since = self.last_input
+    deadline = monotonic() + timeout
+    after = None
+    previous = None
+    while True:
+      frame = self._next_frame(after, since, bbox, deadline)
+      if frame is not None and frame.started >= since:
+        after = frame.sequence
+        thumbnail = self._thumbnail(frame)
+        if previous is None or thumbnail.shape != previous.shape or (thumbnail != previous).any():
+          found = self.match_many(templates, source=frame, bbox=bbox, **kwargs)
+          visible = dict((t, found[t][0].point) for t in templates if found[t])
+          if complete(t in visible for t in templates):
+            return visible
+        previous = thumbnail
+      if monotonic() >= deadline:
+        raise Timeout("Timeout beim Warten auf Steuerelement: " + ', '.join(templates))
+
+  def wait_any(self, templates, timeout=None, bbox=None, since=None, **kwargs):
+    """Wait until at least one of ``templates`` is visible in a frame captured after the last
+    input (or after ``since``, on the :func:`monotonic` clock). Frames are captured in the
+    background while the previous one is matched, see :func:`capture_thread`.
+
+    :returns: The position of every template visible in that frame, by name.
+    :rtype: dict
+    :raises: :class:`Timeout` after ``timeout`` seconds.
+    """
+    return self._wait_visible(templates, any, timeout, bbox, since, **kwargs)
+
+  def wait_all(self, templates, timeout=None, bbox=None, since=None, **kwargs):
+    """Like :func:`wait_any`, but wait until all of ``templates`` are visible in the same frame."""
+    return self._wait_visible(templates, all, timeout, bbox, since, **kwargs)
 
   def locate(self, im, **kwargs):
     try:
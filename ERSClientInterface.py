@@ -4,13 +4,23 @@ Created on 24.05.2015
 @author: Raimar Sandner
 '''
 
-from ClientInterface import ClientInterface, Point, BBox, Timeout
+from ClientInterface import ClientInterface, Point, BBox, Frame, LocationPriors, Timeout, monotonic, longsleep
 import os
 import ConfigParser
 import logging
 import StringIO
 import random, string
 import time
+import functools
+import json
+import Instrumentation
+import Latency
+import TemplateBundle
+from Prefilter import Prefilter
+from PageClassifier import PageClassifier
+import FlowPlan
+from FlowPlan import Step, Checkpoint
+from collections import OrderedDict
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -20,28 +30,151 @@ logger.setLevel(logging.DEBUG)
 logger.handlers = [handler]
 logger.propagate = False
 
+config_file = os.path.expanduser('~/.ersTestSuite/config.txt')
+calibration_templates = ('logo', 'help', 'site_loaded')
+# the templates confirming each page of the site
+pages = OrderedDict([('products', ['week_ticket', 'day_ticket', 'gala_show_ticket']),
+                     ('cart', ['reset_all']),
+                     ('checkout', ['add_buyer', 'no_buyer']),
+                     ('payment', ['sepa', 'credit']),
+                     ('success', ['sepa_success', 'credit_success'])])
+
+
+def action(f):
+  """Decorator for ERS actions, tags the instrumentation spans with the name of the action."""
+  @functools.wraps(f)
+  def wrapper(self, *args, **kwargs):
+    with self.profiler.tag(action=f.__name__):
+      return f(self, *args, **kwargs)
+  return wrapper
+
 def randomword(length):
   return ''.join(random.choice(string.lowercase) for _ in range(length))
 
 class ERSClientInterface(ClientInterface):
-  def __init__(self, delay=0):
+  def __init__(self, delay=0, capture=None):
     self.global_bbox = None
-    self.config = self.config_parser(os.path.expanduser('~/.ersTestSuite/config.txt'))
-    ClientInterface.__init__(self, self.config.get('Config', 'display'))
+    self._page_dirty = True
+    self._loaded_at = None
+    self._measured_step = None
+    self._plan_depth = 0
+    self.config = self.config_parser(config_file)
+    ClientInterface.__init__(self, self.config.get('Config', 'display'),
+                             capture=capture or self.config.get('Config', 'capture'),
+                             fbdir=self.config.get('Config', 'fbdir') or None)
     self.imagedirs = [os.path.join(self.config.get('Config', 'basedir'), 'images'), os.path.join(self.config.get('Config', 'packagedir'), 'images')]
+    if self.config.getboolean('Config', 'bundle'):
+      try:
+        self.templates.bundle = TemplateBundle.TemplateBundle.load(self._datafile('templates.bundle'), self.imagedirs)
+      except (IOError, OSError) as e:
+        logger.warning('Could not load the template bundle: {}'.format(e))
     self.timeout = self.config.get('Config', 'timeout')
+    if self.config.get('Config', 'latency'):
+      Latency.enable()
+    if self.config.get('Config', 'profile'):
+      self.profiler = Instrumentation.enable()
+    if self.config.get('Config', 'record'):
+      from Replay import Recorder
+      self.recorder = Recorder.create(self.config.get('Config', 'record'), self.size())
 
     if delay:
       logger.info('Sleeping {} seconds, please bring browser to front.'.format(delay))
       time.sleep(delay)
-    left = Point(self.locate('logo')[0] - 62, 0)
-    right = Point(self.locate('help')[0] + 80, self.size()[1])
+    calibration = self._calibrate()
+    left = Point(calibration['logo'][0] - 62, 0)
+    right = Point(calibration['help'][0] + 80, self.size()[1])
     self.global_bbox = BBox(left[0], left[1], right[0], right[1])
-    site_loaded = self.locate('site_loaded')
+    self.search_bbox = self.global_bbox
+    self.watch_region = self.global_bbox
+    layout = '{}x{}+{}+{}'.format(self.size()[0], self.size()[1], left[0], left[1])
+    self.priors = LocationPriors.load(self._datafile('priors.json'), layout)
+    self.page_classifier = PageClassifier.load(self._datafile('pages.json'), layout, pages)
+    site_loaded = calibration['site_loaded']
     self.loaded_bbox = (site_loaded - Point(17, 17)) * (site_loaded + Point(17, 17))
     self.confidence = self.config.getfloat('Config', 'confidence')
+    self.pyramid = self.config.getint('Config', 'pyramid')
+    self.match_processes = self.config.getint('Config', 'match_processes')
+    if self.config.getboolean('Config', 'prefilter'):
+      self.prefilter = Prefilter()
+    self.loaded_ttl = self.config.getfloat('Config', 'loaded_ttl')
+    self.settle_frames = self.config.getint('Config', 'settle_frames')
+    self.pacing = self.config.get('Config', 'pacing')
+    self.input_mode = self.config.get('Config', 'input')
+    self.retries = self.config.getint('Config', 'retries')
+
+  @classmethod
+  def shared(cls):
+    """:returns: An instance shared by all callers, it is created (and calibrated) on first use."""
+    if cls.__dict__.get('_shared') is None:
+      cls._shared = cls()
+    return cls._shared
+
+  def _calibration_key(self):
+    """The display, the screen size and the modification times of the calibration templates."""
+    mtimes = ','.join('{:.0f}'.format(os.stat(self.templates.path(name)).st_mtime)
+                      for name in calibration_templates)
+    return '{} {}x{} {}'.format(self.config.get('Config', 'display'), self.size()[0], self.size()[1], mtimes)
+
+  def _calibrate(self):
+    """Find the calibration templates. The positions are cached in the base directory, if the
+    cached positions are still valid only a small region around each of them is checked.
+
+    :returns: The positions by template name.
+    :rtype: dict
+    """
+    filename = self._datafile('calibration.json')
+    key = self._calibration_key()
+    try:
+      with open(filename) as f:
+        cache = json.load(f)
+    except (IOError, ValueError):
+      cache = {}
+    if key in cache:
+      positions = dict((name, Point(*pos)) for name, pos in cache[key].items())
+      if self._check_calibration(positions):
+        logger.debug('Using cached calibration for {}.'.format(key))
+        return positions
+      logger.info('Cached calibration does not match the screen, recalibrating.')
+    positions = dict((name, self.locate(name)) for name in calibration_templates)
+    cache[key] = dict((name, list(pos)) for name, pos in positions.items())
+    try:
+      with open(filename, 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    except IOError as e:
+      logger.warning('Could not save calibration: {}'.format(e))
+    return positions
+
+  def _check_calibration(self, positions, padding=5):
+    """:returns: ``True`` if all calibration templates are visible at ``positions`` (checked on a
+      single screenshot of the regions around them).
+    """
+    (width, height) = self.size()
+    regions = {}
+    for name in calibration_templates:
+      if name not in positions:
+        return False
+      (h, w) = self.templates.get(name).shape[:2]
+      (x, y) = positions[name]
+      regions[name] = BBox(max(0, x - w // 2 - padding), max(0, y - h // 2 - padding),
+                           min(width - 1, x + w - w // 2 + padding), min(height - 1, y + h - h // 2 + padding))
+    bbox = None
+    for region in regions.values():
+      bbox = region if bbox is None else bbox.union(region)
+    frame = self.snapshot(bbox=bbox)
+    return all(self.match(name, source=frame, bbox=region) for name, region in regions.items())
+
+  def _datafile(self, name):
+    """:returns: The path of the file ``name`` in the base directory, which is created if necessary."""
+    basedir = self.config.get('Config', 'basedir')
+    if not os.path.isdir(basedir):
+      os.makedirs(basedir)
+    return os.path.join(basedir, name)
 
-  def config_parser(self, files=None):
+  @staticmethod
+  def config_parser(files=None):
+    """Read the configuration from ``files`` on top of the defaults. Options of the ``Config``
+    section can be overridden by environment variables, e.g. ``ERSTESTSUITE_DISPLAY=:5``.
+    """
     if files is None: files = []
     if type(files) is str: files = [files]
     defaults = """
@@ -51,6 +184,27 @@ packagedir={packagedir}
 display=:0
 timeout=10
 confidence=0.8
+capture=auto
+fbdir=
+pyramid=0
+prefilter=false
+match_processes=0
+bundle=true
+loaded_ttl=2
+settle_frames=2
+pacing=fixed
+input=type
+retries=0
+record=
+profile=
+latency=
+[Parallel]
+workers=2
+first_display=10
+screen=1920x1080x24
+browser=firefox -no-remote -profile {{profile}} {{url}}
+url=
+startup=20
 [Person]
 email=disp.reg.ejc.RND@typename.de
 name1=Raimar Sandner
@@ -63,25 +217,171 @@ creditcard_sec=123
     config.optionxform = str
     config.readfp(StringIO.StringIO(defaults))
     config.read(map(os.path.expanduser, files))
+    for option in config.options('Config'):
+      value = os.environ.get('ERSTESTSUITE_' + option.upper())
+      if value is not None:
+        config.set('Config', option, value)
     return config
 
-  def wait_site_loaded(self):
-    self.waitforelement('site_loaded', bbox=self.loaded_bbox)
+  def _input_event(self, kind, *args):
+    super(ERSClientInterface, self)._input_event(kind, *args)
+    self._page_dirty = True
 
-  def clickto(self, *args, **kwargs):
-    self.wait_site_loaded()
-    return super(ERSClientInterface, self).clickto(*args, **kwargs)
+  def wait_site_loaded(self, region=None, force=False):
+    """Wait until the site has finished loading and settled: the loading indicator and
+    ``region`` look the same in :attr:`settle_frames` consecutive frames.
+
+    The check is skipped if there was no input since the last check and that check is less
+    than :attr:`loaded_ttl` seconds old, unless ``force`` is ``True``.
+    """
+    if (not force and not self._page_dirty and self._loaded_at is not None
+        and monotonic() - self._loaded_at < self.loaded_ttl):
+      return
+    with self.profiler.span('wait_site'):
+      self._wait_settled(region)
+
+  def _wait_settled(self, region, react=0):
+    """Poll until the site is loaded and settled. With ``react``, the site is expected to react
+    to the last input: frames only count once the screen changed after the first one, if it does
+    not change within ``react`` seconds of the input, the site counts as settled.
+
+    :returns: The capture start of the first of the settled frames, ``None`` if the site did not
+      react.
+    """
+    bbox = self.loaded_bbox if region is None else self.loaded_bbox.union(region)
+    deadline = monotonic() + self.default_timeout
+    previous = None
+    stable = 0
+    first = None
+    reacted = True
+    while True:
+      frame = self.snapshot(bbox=bbox, buffer='settle')
+      thumbnail = self._thumbnail(frame, factor=4)
+      if react:
+        if first is None:
+          first = thumbnail
+        if thumbnail.shape == first.shape and (thumbnail == first).all():
+          if monotonic() < self.last_input + react:
+            self._sleep(self.poll_interval)
+            continue
+          # no reaction, the frames since the first one have all been stable
+          (previous, stable, reacted) = (thumbnail, max(1, self.settle_frames - 1), False)
+        react = 0
+      if self.site_loaded(frame):
+        unchanged = previous is not None and thumbnail.shape == previous.shape and (thumbnail == previous).all()
+        if not unchanged or not stable:
+          (stable, ready) = (0, frame.started)
+        stable += 1
+        if stable >= self.settle_frames:
+          self._page_dirty = False
+          self._loaded_at = monotonic()
+          return ready if reacted else None
+      else:
+        stable = 0
+      previous = thumbnail
+      if monotonic() >= deadline:
+        raise Timeout("Timeout beim Warten auf Steuerelement: site_loaded")
+      self._sleep(self.poll_interval)
+
+  def site_loaded(self, frame):
+    """:returns: ``True`` if the site had finished loading when ``frame`` was captured."""
+    return ClientInterface.isvisible(self, 'site_loaded', bbox=self.loaded_bbox, source=frame)
+
+  def clickto(self, point, *args, **kwargs):
+    """Click on ``point`` once the site is loaded. With latency measurement on, the time until
+    the site is loaded again, and the template ``until`` is visible if given, is recorded for the
+    step ``name`` (default: the template ``point``).
+    """
+    name = kwargs.pop('name', point if type(point) is str else None)
+    until = kwargs.pop('until', None)
+    self.wait_site_loaded(region=self.expected_region(point))
+    if Latency.recorder.enabled and name is not None:
+      self._measured_step = (name, until)
+    try:
+      return super(ERSClientInterface, self).clickto(point, *args, **kwargs)
+    finally:
+      self._measured_step = None
+
+  def _click(self, clicksleep=longsleep, **kwargs):
+    """A click measured by :func:`clickto` does not pause: the site is polled right after the
+    input, for at most ``clicksleep`` seconds until it reacts, so that fast responses are timed.
+    A click the site does not react to is not recorded.
+    """
+    if self._measured_step is None:
+      return super(ERSClientInterface, self)._click(clicksleep=clicksleep, **kwargs)
+    (step, until) = self._measured_step
+    self._measured_step = None
+    super(ERSClientInterface, self)._click(clicksleep=0, **kwargs)
+    clicked = self.last_input
+    with self.profiler.span('wait_site'):
+      ready = self._wait_settled(None, react=clicksleep)
+      if ready is None:
+        logger.debug('No reaction to the click on {}, no latency recorded.'.format(step))
+        return
+      if until is not None:
+        appeared = self._appeared(until)
+        if appeared is None:
+          logger.debug('{} did not appear after the click on {}, no latency recorded.'.format(until, step))
+          return
+        ready = max(ready, appeared)
+    Latency.recorder.add(step, ready - clicked)
+
+  def _appeared(self, template):
+    """:returns: The capture start of the first frame polled from now on which shows ``template``,
+      ``None`` if it is not visible within :attr:`default_timeout` seconds.
+    """
+    deadline = monotonic() + self.default_timeout
+    while True:
+      frame = self.snapshot(buffer='wait')
+      if ClientInterface.isvisible(self, template, source=frame):
+        return frame.started
+      if monotonic() >= deadline:
+        return None
+      self._sleep(self.poll_interval)
 
   def isvisible(self, *args, **kwargs):
-    self.wait_site_loaded()
+    frame = kwargs.get('source')
+    if isinstance(frame, Frame) and frame.contains(self.loaded_bbox):
+      # a snapshot cannot wait, it only counts if the site was loaded when it was taken
+      if not self.site_loaded(frame):
+        return False
+    else:
+      self.wait_site_loaded()
     return super(ERSClientInterface, self).isvisible(*args, **kwargs)
 
+  def whichvisible(self, *args, **kwargs):
+    self.wait_site_loaded()
+    return super(ERSClientInterface, self).whichvisible(*args, **kwargs)
+
+  def current_page(self):
+    """:returns: The name of the page shown in the browser (one of :data:`pages`) or ``None``.
+
+    The page is recognised by the fingerprint of :attr:`global_bbox` and confirmed by one of its
+    templates. If that fails, all confirmation templates are matched and the fingerprint of the
+    page found is learned.
+    """
+    self.wait_site_loaded()
+    frame = self.snapshot(bbox=self.global_bbox)
+    image = frame.region(self.global_bbox)[0]
+    (page, correlation) = self.page_classifier.classify(image)
+    if page is not None:
+      if any(self.match_many(pages[page], source=frame, bbox=self.global_bbox).values()):
+        return page
+      logger.debug('Page {} (correlation {:.2f}) not confirmed.'.format(page, correlation))
+    confirmed = self.page_classifier.label(self, frame, self.global_bbox)
+    if len(confirmed) == 1:
+      self.page_classifier.learn(confirmed[0], image)
+      return confirmed[0]
+    return None
+
+  @action
   def empty_shopping_cart(self):
     self.clickto('my_shopping_cart')
     self.waitforelement('reset_all')
     self.clickto('reset_all')
     self.clickto('yes')
 
+  @action
   def go_home(self):
     self.clickto('logo')
     self.wait_site_loaded()
@@ -91,26 +391,28 @@ creditcard_sec=123
       if person_id is None: person_id = 1
       name = self.config.get('Person', 'name' + str(person_id))
     self.clickto('first_name')
-    self.type_string(name.split()[0])
+    self.enter_text(name.split()[0])
     self.keypress('tab')
-    self.type_string(name.split()[1])
+    self.enter_text(name.split()[1])
     self.keypress('tab')
 
   def _enter_email(self, email=None):
     if email is None:
       email = self.config.get('Person', 'email').replace('RND', randomword(5))
-    self.type_string(email)
+    self.enter_text(email)
     self.keypress('tab')
 
+  @action
   def login(self):
     self.clickto('login')
     self.clickto('email')
-    self.type_string(self.config.get('Config', 'username'))
+    self.enter_text(self.config.get('Config', 'username'))
     self.keypress('tab', s=0.5)
-    self.type_string(self.config.get('Config', 'password'))
+    self.enter_text(self.config.get('Config', 'password'))
     self.keypress('enter')
     self.waitforelement('my_profile')
 
+  @action
   def add_person(self, name=None, email=None, age='normal', person_id=None, if_necessary=True):
     if if_necessary:
       if self.isvisible('this_ticket'):
@@ -118,23 +420,24 @@ creditcard_sec=123
     self.clickto('add_a_new_person')
     self._enter_name(name=name, person_id=person_id)
     if age == 'normal':
-      self.type_string('1.1.1980')
+      self.enter_text('1.1.1980')
     elif age == 'reduced':
-      self.type_string('1.1.2005')
+      self.enter_text('1.1.2005')
     else:
-      self.type_string('1.1.2010')
+      self.enter_text('1.1.2010')
     self.keypress('tab')
     self._enter_email(email=email)
-    self.keypress('down')
-    self.keypress('down')
+    self.key_sequence(['down', 'down'])
     self.clickto('save')
 
+  @action
   def add_buyer(self, name=None, email=None, person_id=None):
     self.clickto('add_buyer')
     self._enter_name(name=name, person_id=None)
     self._enter_email(email=email)
     self.keypress('enter')
 
+  @action
   def select_week_ticket(self, name=None, email=None, age='normal', always_add=False, person_id=None):
     self.clickto('week_ticket')
     self.add_person(name=name, email=email, age=age, if_necessary=not always_add, person_id=person_id)
@@ -142,15 +445,16 @@ creditcard_sec=123
     self.keypress('down')
     self.keypress('enter')
 
+  @action
   def select_day_ticket(self, name=None, email=None, age='normal', always_add=False, person_id=None, day=2):
     self.clickto('day_ticket')
     self.add_person(name=name, email=email, age=age, if_necessary=not always_add, person_id=None)
     self.clickto('day')
-    for _ in range(day):
-      self.keypress('down')
+    self.key_sequence(['down'] * day)
     self.keypress('enter')
     self.wait_site_loaded()
 
+  @action
   def select_gala_ticket(self, age='normal'):
     self.clickto('gala_show_ticket')
     self.clickto('gala_{}'.format(age))
@@ -159,41 +463,77 @@ creditcard_sec=123
     self.keypress('enter')
     self.wait_site_loaded()
 
+  def checkout_plan(self, amount, payment='sepa'):
+    """:returns: The steps of :func:`checkout` from the shopping cart on, to be part of a larger plan."""
+    if payment not in ('sepa', 'credit'):
+      raise NotImplementedError("Payment type {} not implemented.".format(payment))
+    return FlowPlan.tagged([Checkpoint('cart_filled', page='cart'),
+                            Step('clickto', 'continue'),
+                            Step('_choose_buyer'),
+                            Step('clickto', 'save_and_continue'),
+                            Checkpoint('buyer_set', page='payment'),
+                            Step('clickto', payment),
+                            Step('clickto', 'save_and_continue'),
+                            Checkpoint('payment_chosen', template='i_accept'),
+                            Step('clickto', 'i_accept'),
+                            Step('isvisible', 'amount_{}'.format(str(amount).replace('.', ',')))],
+                           action='checkout')
+
+  @action
   def checkout(self, amount, payment='sepa'):
-    if not self.isvisible('reset_all'):
+    plan = self.checkout_plan(amount, payment)
+    if self.current_page() != 'cart':
       self.clickto('my_shopping_cart')
-    self.clickto('continue')
-    if self.isvisible('empty_radio_button'):
+    return self.run_plan(plan)
+
+  def _choose_buyer(self):
+    visible = self.whichvisible(['empty_radio_button', 'no_buyer'])
+    if 'empty_radio_button' in visible:
       self.clickto('empty_radio_button')
-    elif self.isvisible('no_buyer'):
+    elif 'no_buyer' in visible:
       self.add_buyer()
-    self.clickto('save_and_continue')
-    if payment == 'sepa': self.clickto('sepa')
-    elif payment == 'credit': self.clickto('credit')
-    else: raise NotImplementedError("Payment type {} not implemented.".format(payment))
-    self.clickto('save_and_continue')
-    self.clickto('i_accept')
-    return self.isvisible('amount_{}'.format(str(amount).replace('.', ',')))
 
-  def pay(self, payment='sepa'):
-    self.clickto('buy_now')
+  def pay_plan(self, payment='sepa'):
+    """:returns: The steps of :func:`pay`, to be part of a larger plan."""
+    plan = [Checkpoint('checked_out', template='buy_now'),
+            Step('clickto', 'buy_now')]
     if payment == 'sepa':
-      return self.isvisible('sepa_success')
-    if payment == 'credit':
-      self.clickto('cardholder')
-      self.type_string(self.config.get('Person', 'name1'))
-      self.keypress('tab')
-      self.keypress('tab')
-      self.type_string(self.config.get('Person', 'creditcard_number'))
-      self.keypress('tab')
-      self.type_string(self.config.get('Person', 'creditcard_sec'))
-      self.keypress('tab')
-      for _ in range(8): self.keypress('down')
-      self.keypress('tab');self.keypress('tab');
-      self.keypress('enter')
-      return self.isvisible('credit_success')
+      plan += [Step('isvisible', 'sepa_success')]
+    elif payment == 'credit':
+      plan += [Checkpoint('card_form', template='cardholder'),
+               Step('clickto', 'cardholder'),
+               Step('enter_text', self.config.get('Person', 'name1')),
+               Step('key_sequence', ['tab', 'tab']),
+               Step('enter_text', self.config.get('Person', 'creditcard_number')),
+               Step('keypress', 'tab'),
+               Step('enter_text', self.config.get('Person', 'creditcard_sec')),
+               Step('keypress', 'tab'),
+               Step('key_sequence', ['down'] * 8),
+               Step('key_sequence', ['tab', 'tab']),
+               Step('keypress', 'enter'),
+               Step('isvisible', 'credit_success')]
+    else:
+      raise NotImplementedError("Payment type {} not implemented.".format(payment))
+    return FlowPlan.tagged(plan, action='pay')
+
+  @action
+  def pay(self, payment='sepa'):
+    return self.run_plan(self.pay_plan(payment))
 
+  def run_plan(self, plan):
+    """Execute ``plan``, a list of :class:`FlowPlan.Step` objects, see :func:`FlowPlan.execute`.
+    Failed steps are retried from the last recognised checkpoint at most :attr:`retries` times.
+    Plans run by a step of another plan are not retried, their failures are retried by the
+    outer plan, which would otherwise multiply the attempts. To resume inside such a part of a
+    flow, its steps and checkpoints have to be in the outer plan, like :func:`checkout_plan`.
+    """
+    self._plan_depth += 1
+    try:
+      return FlowPlan.execute(self, plan, retries=self.retries if self._plan_depth == 1 else 0)
+    finally:
+      self._plan_depth -= 1
 
+  @action
   def order_ticket(self, ticket='week', name=None, email=None, age='normal', payment='sepa', login=False):
     amounts = {'sepa':
                {('week', 'normal'):180,
@@ -218,45 +558,46 @@ creditcard_sec=123
               }
     if login:
       self.login()
-    self.clickto('products')
-    if   ticket == 'week': self.select_week_ticket(name=name, email=email, age=age)
-    elif ticket == 'day' : self.select_day_ticket(name=name, email=email, age=age)
-    elif ticket == 'gala': self.select_gala_ticket(age=age)
+    if   ticket == 'week': select = Step('select_week_ticket', name=name, email=email, age=age)
+    elif ticket == 'day' : select = Step('select_day_ticket', name=name, email=email, age=age)
+    elif ticket == 'gala': select = Step('select_gala_ticket', age=age)
     else: raise NotImplementedError("Ticket type {} not implemented.".format(ticket))
-    self.clickto('add_to_cart')
-    self.clickto('shopping_cart_next')
-    if not self.checkout(amount=amounts[payment][(ticket, age)], payment=payment): return False
-    return self.pay(payment=payment)
+    return self.run_plan([Step('clickto', 'products'),
+                          select,
+                          Checkpoint('product_selected', template='add_to_cart'),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'shopping_cart_next')] +
+                         self.checkout_plan(amounts[payment][(ticket, age)], payment) + self.pay_plan(payment))
 
+  @action
   def order_two_weektickets(self):
-    self.clickto('products')
-    self.select_week_ticket(person_id=1)
-    self.clickto('add_to_cart')
-    self.clickto('add_more_products')
-    self.select_week_ticket(person_id=2, always_add=True)
-    self.clickto('add_to_cart')
-    self.clickto('shopping_cart_next')
-    if not self.checkout(amount=360, payment='sepa'): return False
-    return self.pay(payment='sepa')
+    return self.run_plan([Step('clickto', 'products'),
+                          Step('select_week_ticket', person_id=1),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'add_more_products'),
+                          Step('select_week_ticket', person_id=2, always_add=True),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'shopping_cart_next')] +
+                         self.checkout_plan(360) + self.pay_plan())
 
+  @action
   def order_week_and_day(self):
-    self.clickto('products')
-    self.select_week_ticket(person_id=1)
-    self.clickto('add_to_cart')
-    self.clickto('add_more_products')
-    self.select_day_ticket(person_id=2, always_add=True)
-    self.clickto('add_to_cart')
-    self.clickto('shopping_cart_next')
-    if not self.checkout(amount=215, payment='sepa'): return False
-    return self.pay(payment='sepa')
+    return self.run_plan([Step('clickto', 'products'),
+                          Step('select_week_ticket', person_id=1),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'add_more_products'),
+                          Step('select_day_ticket', person_id=2, always_add=True),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'shopping_cart_next')] +
+                         self.checkout_plan(215) + self.pay_plan())
 
+  @action
   def order_two_daytickets(self):
-    self.clickto('products')
-    self.select_day_ticket(day=2)
-    self.clickto('add_to_cart')
-    self.clickto('add_more_products')
-    self.select_day_ticket(day=3)
-    self.clickto('add_to_cart')
-    self.clickto('shopping_cart_next')
-    if not self.checkout(amount=70, payment='sepa'): return False
-    return self.pay(payment='sepa')
+    return self.run_plan([Step('clickto', 'products'),
+                          Step('select_day_ticket', day=2),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'add_more_products'),
+                          Step('select_day_ticket', day=3),
+                          Step('clickto', 'add_to_cart'),
+                          Step('clickto', 'shopping_cart_next')] +
+                         self.checkout_plan(70) + self.pay_plan())
@@ -0,0 +1,219 @@
+'''
+Created on 18.10.2026
+
+Declarative flows: a plan is a list of :class:`Step` objects, executed by :func:`execute`.
+Because the executor knows which templates come next, it loads them in the background while
+the current step runs, and it starts capturing the region where the next target is expected
+(see :func:`ClientInterface.ClientInterface.expected_region`) right after each input.
+
+With ``retries``, a step which fails with :class:`ClientInterface.Timeout` or
+:class:`ClientInterface.ElementError` does not fail the plan right away: the executor looks for
+the last :class:`Checkpoint` passed which is recognised on the screen and resumes after it.
+
+Example::
+
+    execute(ci, [Step('clickto', 'products', expect='week_ticket'),
+                 Step('clickto', 'week_ticket'),
+                 Step('enter_text', 'Raimar'),
+                 Step('keypress', 'tab'),
+                 Checkpoint('person_added', template='this_ticket'),
+                 Step('clickto', 'show')], retries=1)
+'''
+
+import logging
+from ClientInterface import Timeout, ElementError
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+# actions whose target is a template name
+template_actions = ('clickto', 'waitforelement', 'isvisible', 'locate')
+
+
+class Step(object):
+  """One step of a plan.
+
+  :param action: The name of the interface method to call, e.g. ``'clickto'``, ``'enter_text'``
+    or an ERS action like ``'select_week_ticket'``.
+  :type action: str
+  :param target: The first argument of the method, a template name for :data:`template_actions`.
+  :param expect: A template which is visible after the step, the executor waits for it.
+  :type expect: str
+  :param kwargs: Further keyword arguments of the method.
+  """
+
+  def __init__(self, action, target=None, expect=None, **kwargs):
+    self.action = action
+    self.target = target
+    self.expect = expect
+    self.kwargs = kwargs
+    self.tags = {}
+
+  def templates(self):
+    """:returns: The templates this step searches for."""
+    r = []
+    if self.action in template_actions and self.target is not None:
+      r.append(self.target)
+    if self.expect is not None:
+      r.append(self.expect)
+    return r
+
+  def __repr__(self):
+    args = [repr(a) for a in (self.action, self.target) if a is not None]
+    if self.expect is not None:
+      args.append('expect={!r}'.format(self.expect))
+    args += ['{}={!r}'.format(k, v) for k, v in sorted(self.kwargs.items())]
+    return 'Step({})'.format(', '.join(args))
+
+
+class Checkpoint(Step):
+  """A named state of a flow, recognised on screen by the page ``page`` (see
+  :func:`ERSClientInterface.ERSClientInterface.current_page`) and/or a visible ``template``.
+  """
+
+  def __init__(self, name, page=None, template=None):
+    Step.__init__(self, 'checkpoint', name)
+    self.page = page
+    self.template = template
+
+  def templates(self):
+    return [self.template] if self.template is not None else []
+
+  def recognise(self, ci):
+    """:returns: ``True`` if the screen of ``ci`` shows this state."""
+    if self.page is not None and ci.current_page() != self.page:
+      return False
+    return self.template is None or ci.isvisible(self.template)
+
+  def __repr__(self):
+    return 'Checkpoint({!r})'.format(self.target)
+
+
+def tagged(steps, **tags):
+  """Tag the profiler spans of ``steps`` with ``tags``, e.g. the action a part of a larger plan
+  belongs to.
+
+  :returns: ``steps``
+  """
+  for step in steps:
+    step.tags = dict(step.tags, **tags)
+  return steps
+
+
+def _resume(ci, passed):
+  """:returns: The index of the step after the last checkpoint in ``passed`` which is recognised
+    on the screen, or ``None``.
+  """
+  for i in reversed(range(len(passed))):
+    if isinstance(passed[i], Checkpoint):
+      try:
+        if passed[i].recognise(ci):
+          return i + 1
+      except Timeout:
+        pass
+  return None
+
+
+def _prefetch(ci, name, tags):
+  """Load template ``name`` and its pyramid into the template cache, the time spent is recorded
+  with the profiler ``tags`` of the plan.
+  """
+  with ci.profiler.tag(**tags):
+    _load(ci, name)
+
+
+def _load(ci, name):
+  try:
+    gray = ci.templates.get(name)
+    ci.templates.get(name, gray=False)
+    if ci.pyramid:
+      ci.templates.pyramid(name, ci._pyramid_levels(gray))
+  except IOError as e:
+    logger.warning('Cannot prefetch {}: {}'.format(name, e))
+
+
+def _follow_up(step, following):
+  """:returns: The template which is visible once ``step`` is complete: its ``expect`` or the
+    first template of the ``following`` step, if any.
+  """
+  if step.expect is not None:
+    return step.expect
+  templates = following.templates() if following is not None else []
+  return templates[0] if templates else None
+
+
+def _clickto(ci, step, region, timeout, until=None):
+  """Click the target of ``step``: look for it in the frames captured in ``region`` since the last
+  input, then fall back to :func:`ClientInterface.ClientInterface.clickto`. ``until`` is the
+  template showing that the step is complete.
+  """
+  if region is not None and ci.threaded_capture and not step.kwargs:
+    ci.wait_site_loaded(region=region)
+    try:
+      point = ci.wait_any([step.target], bbox=region, timeout=timeout)[step.target]
+    except Timeout:
+      logger.debug('{} not in its expected region.'.format(step.target))
+    else:
+      return ci.clickto(point, name=step.target, until=until)
+  return ci.clickto(step.target, until=until, **step.kwargs)
+
+
+def execute(ci, plan, lookahead=2, region_timeout=0.5, retries=0):
+  """Execute ``plan`` on the interface ``ci``.
+
+  The templates of the next ``lookahead`` steps are loaded on the thread pool of ``ci``. A
+  ``clickto`` step whose target has a known position first looks for it in the frames captured
+  around that position since the previous input, for at most ``region_timeout`` seconds. Failed
+  steps are retried from the last recognised checkpoint at most ``retries`` times.
+
+  :returns: ``False`` if a step returned ``False`` (the remaining steps are skipped), otherwise
+    the result of the last step.
+  """
+  pool = ci._thread_pool()
+  fetched = set()
+  result = None
+  i = 0
+  while i < len(plan):
+    step = plan[i]
+    for name in (t for s in plan[i:i + lookahead + 1] for t in s.templates()):
+      if name not in fetched:
+        fetched.add(name)
+        pool.apply_async(_prefetch, (ci, name, ci.profiler.current_tags()))
+    if isinstance(step, Checkpoint):
+      logger.info('Checkpoint {} reached.'.format(step.target))
+      i += 1
+      continue
+    try:
+      with ci.profiler.tag(**step.tags):
+        if step.action == 'clickto':
+          until = _follow_up(step, plan[i + 1] if i + 1 < len(plan) else None)
+          result = _clickto(ci, step, ci.expected_region(step.target), region_timeout, until)
+        else:
+          method = getattr(ci, step.action)
+          result = method(step.target, **step.kwargs) if step.target is not None else method(**step.kwargs)
+    except (Timeout, ElementError) as e:
+      resume = _resume(ci, plan[:i]) if retries > 0 else None
+      if resume is None:
+        raise
+      retries -= 1
+      logger.warning('{} failed ({}), resuming after {}.'.format(step, e, plan[resume - 1]))
+      i = resume
+      continue
+    if result is False:
+      logger.info('{} failed, skipping the rest of the plan.'.format(step))
+      return False
+    # start capturing where the next target is expected right after the input
+    following = plan[i + 1] if i + 1 < len(plan) else None
+    if following is not None and following.action == 'clickto' and ci.threaded_capture:
+      region = ci.expected_region(following.target)
+      if region is not None:
+        ci.capture_thread(region).retarget(region)
+    if step.expect is not None:
+      ci.wait_any([step.expect], bbox=ci.search_bbox)
+    i += 1
+  return result
@@ -0,0 +1,172 @@
+'''
+Created on 18.10.2026
+
+Timing of the phases of the image recognition hot path (capture, decode, correlate, sleep,
+waiting for the site), tagged by template name and ERS action.
+
+Instrumentation is off by default, :data:`profiler` is then a :class:`NullProfiler` whose
+methods do nothing. :func:`enable` replaces it by a shared :class:`Profiler`.
+'''
+
+import json
+import time
+import threading
+from collections import defaultdict
+
+
+class _NullContext(object):
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc):
+    return False
+
+
+_null_context = _NullContext()
+
+
+class NullProfiler(object):
+  """A profiler which records nothing."""
+  enabled = False
+
+  def span(self, phase):
+    return _null_context
+
+  def tag(self, **tags):
+    return _null_context
+
+  def current_tags(self):
+    return {}
+
+  def begin_test(self, name):
+    pass
+
+
+class _Span(object):
+
+  def __init__(self, profiler, phase):
+    self.profiler = profiler
+    self.phase = phase
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, *exc):
+    self.profiler._add(self.phase, time.time() - self.start)
+    return False
+
+
+class _Tag(object):
+
+  def __init__(self, profiler, tags):
+    self.profiler = profiler
+    self.tags = tags
+
+  def __enter__(self):
+    self.profiler._tags().append(self.tags)
+    return self
+
+  def __exit__(self, *exc):
+    self.profiler._tags().pop()
+    return False
+
+
+class Profiler(object):
+  """Accumulates the number of calls and the time spent per phase, separately for every test
+  and broken down by the innermost ERS action and template.
+
+  Usage::
+
+      with profiler.tag(action='checkout'):
+        with profiler.tag(template='continue'):
+          with profiler.span('correlate'):
+            ...
+
+  Spans can be nested, e.g. ``wait_site`` contains the ``capture`` and ``correlate`` spans of
+  the checks it performs.
+  """
+  enabled = True
+
+  def __init__(self):
+    self.test = None
+    self._lock = threading.Lock()
+    self._local = threading.local()
+    # (test, action, template, phase) -> [count, seconds]
+    self._records = defaultdict(lambda: [0, 0.])
+
+  def _tags(self):
+    if not hasattr(self._local, 'tags'):
+      self._local.tags = []
+    return self._local.tags
+
+  def _current(self, key):
+    for tags in reversed(self._tags()):
+      if key in tags:
+        return tags[key]
+    return None
+
+  def _add(self, phase, seconds):
+    key = (self.test, self._current('action'), self._current('template'), phase)
+    with self._lock:
+      record = self._records[key]
+      record[0] += 1
+      record[1] += seconds
+
+  def span(self, phase):
+    """:returns: A context manager recording the time spent in ``phase``."""
+    return _Span(self, phase)
+
+  def tag(self, **tags):
+    """:returns: A context manager tagging all spans inside it, e.g. with ``action`` or ``template``."""
+    return _Tag(self, tags)
+
+  def current_tags(self):
+    """:returns: The tags in effect in the current thread, to apply them with :func:`tag` to
+      work done for it on other threads.
+    :rtype: dict
+    """
+    r = {}
+    for tags in self._tags():
+      r.update(tags)
+    return r
+
+  def begin_test(self, name):
+    """Record all following spans for test ``name``."""
+    self.test = name
+
+  def report(self):
+    """:returns: Per test: the totals per phase, and per phase broken down by action and template.
+    :rtype: dict
+    """
+    report = {}
+    with self._lock:
+      records = list(self._records.items())
+    for (test, action, template, phase), (count, seconds) in records:
+      r = report.setdefault(test or 'none', dict(total={}, by_action={}, by_template={}))
+      for (group, key) in ((r['total'], None), (r['by_action'], action), (r['by_template'], template)):
+        if group is not r['total']:
+          group = group.setdefault(key or 'none', {})
+        entry = group.setdefault(phase, dict(count=0, seconds=0.))
+        entry['count'] += count
+        entry['seconds'] += seconds
+    return report
+
+  def save(self, filename):
+    with open(filename, 'w') as f:
+      json.dump(self.report(), f, indent=1, sort_keys=True)
+
+
+profiler = NullProfiler()
+
+
+def enable():
+  """Switch instrumentation on.
+
+  :returns: The shared :class:`Profiler`.
+  """
+  global profiler
+  if not profiler.enabled:
+    profiler = Profiler()
+  return profiler
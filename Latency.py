@@ -0,0 +1,136 @@
+'''
+Created on 18.10.2026
+
+Response latency of the site as perceived by a user: the time from a click until the site
+has finished loading and settled, recorded per step (the template clicked) into histograms.
+
+Measurement is off by default, :data:`recorder` is then a :class:`NullRecorder`.
+:func:`enable` replaces it by a shared :class:`LatencyRecorder`.
+'''
+
+import json
+import math
+import threading
+from collections import defaultdict
+
+
+class Histogram(object):
+  """A histogram of durations with logarithmic buckets: bucket ``i`` holds the durations
+  between ``base**i`` and ``base**(i+1)`` milliseconds, so percentiles are accurate to about
+  ``base - 1`` (relative) for any range of durations.
+  """
+  base = 1.05
+
+  def __init__(self):
+    self.buckets = defaultdict(int)
+    self.count = 0
+    self.total = 0.
+    self.max = 0.
+
+  def add(self, seconds):
+    ms = max(seconds * 1000, 0.01)
+    self.buckets[int(math.floor(math.log(ms, self.base)))] += 1
+    self.count += 1
+    self.total += seconds
+    self.max = max(self.max, seconds)
+
+  def percentile(self, p):
+    """:returns: The duration in seconds below which ``p`` percent of the samples are."""
+    if not self.count:
+      return None
+    rank = p / 100. * self.count
+    seen = 0
+    for i in sorted(self.buckets):
+      seen += self.buckets[i]
+      if seen >= rank:
+        # geometric middle of the bucket
+        return min(self.base ** (i + 0.5) / 1000, self.max)
+    return self.max
+
+  def merge(self, other):
+    for i, n in other.buckets.items():
+      self.buckets[i] += n
+    self.count += other.count
+    self.total += other.total
+    self.max = max(self.max, other.max)
+
+  def summary(self):
+    """:returns: The number of samples, the mean, some percentiles and the maximum in milliseconds.
+    :rtype: dict
+    """
+    r = dict(count=self.count, mean_ms=1000 * self.total / self.count if self.count else None,
+             max_ms=1000 * self.max)
+    for p in (50, 90, 99):
+      value = self.percentile(p)
+      r['p{}_ms'.format(p)] = 1000 * value if value is not None else None
+    return r
+
+  def to_dict(self):
+    return dict(buckets=dict((str(i), n) for i, n in self.buckets.items()),
+                count=self.count, total=self.total, max=self.max)
+
+  @classmethod
+  def from_dict(cls, d):
+    h = cls()
+    for i, n in d['buckets'].items():
+      h.buckets[int(i)] = n
+    h.count = d['count']
+    h.total = d['total']
+    h.max = d['max']
+    return h
+
+
+class NullRecorder(object):
+  """A recorder which records nothing."""
+  enabled = False
+
+  def add(self, step, seconds):
+    pass
+
+
+class LatencyRecorder(object):
+  """One :class:`Histogram` per step."""
+  enabled = True
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.histograms = defaultdict(Histogram)
+
+  def add(self, step, seconds):
+    with self._lock:
+      self.histograms[step].add(seconds)
+
+  def merge(self, histograms):
+    """Add the histograms of another recorder, as returned by :func:`to_dict`."""
+    with self._lock:
+      for step, d in histograms.items():
+        self.histograms[step].merge(Histogram.from_dict(d))
+
+  def to_dict(self):
+    with self._lock:
+      return dict((step, h.to_dict()) for step, h in self.histograms.items())
+
+  def report(self):
+    """:returns: The :func:`Histogram.summary` of every step.
+    :rtype: dict
+    """
+    with self._lock:
+      return dict((step, h.summary()) for step, h in self.histograms.items())
+
+  def save(self, filename):
+    with open(filename, 'w') as f:
+      json.dump(self.report(), f, indent=1, sort_keys=True)
+
+
+recorder = NullRecorder()
+
+
+def enable():
+  """Switch latency measurement on.
+
+  :returns: The shared :class:`LatencyRecorder`.
+  """
+  global recorder
+  if not recorder.enabled:
+    recorder = LatencyRecorder()
+  return recorder
@@ -0,0 +1,98 @@
+'''
+Created on 18.10.2026
+
+Find out at which load the response latency of an ERS deployment degrades: run the same
+order flow many times with increasing numbers of concurrent browsers (each on its own Xvfb
+display, as :mod:`ParallelRunner` does) and report the latency percentiles of every step at
+every concurrency level, e.g.::
+
+    python LoadTest.py --levels 1 2 4 8 --flows 16 --save ~/ers-load.json OrderTestCase.test_two_weektickets
+
+The deployment is the ``url`` of the ``Parallel`` section of the configuration.
+'''
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+import Latency
+import ParallelRunner
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+
+def run_level(test, concurrency, flows):
+  """Run ``test`` ``flows`` times on ``concurrency`` displays at once.
+
+  :returns: The latency report (see :func:`Latency.LatencyRecorder.report`), the number of
+    flows by outcome and the elapsed time.
+  :rtype: dict
+  """
+  # the interfaces in the workers pick this up and measure latencies
+  os.environ['ERSTESTSUITE_LATENCY'] = os.environ.get('ERSTESTSUITE_LATENCY') or 'on'
+  recorder = Latency.LatencyRecorder()
+  outcomes = {}
+  shards = [[test] * (flows // concurrency + (i < flows % concurrency)) for i in range(concurrency)]
+  shards = [s for s in shards if s]
+  queue = multiprocessing.Queue()
+  processes = [multiprocessing.Process(target=ParallelRunner._worker, args=(i, s, queue))
+               for i, s in enumerate(shards)]
+  start = time.time()
+  for p in processes:
+    p.start()
+  for r in ParallelRunner.messages(processes, queue):
+    if 'latency' in r:
+      recorder.merge(r['latency'])
+    else:
+      outcomes[r['outcome']] = outcomes.get(r['outcome'], 0) + 1
+  missing = flows - sum(outcomes.values())
+  if missing:
+    # flows of workers which died
+    outcomes['error'] = outcomes.get('error', 0) + missing
+  return dict(concurrency=len(shards), flows=flows, outcomes=outcomes, elapsed=time.time() - start,
+              steps=recorder.report())
+
+
+def format_table(levels):
+  """:returns: The median and the 90th and 99th percentile of every step at every level as text."""
+  lines = ['{:<24}{:>6}{:>8}{:>10}{:>10}{:>10}'.format('step', 'conc.', 'count', 'p50 ms', 'p90 ms', 'p99 ms')]
+  steps = sorted(set(step for level in levels for step in level['steps']))
+  for step in steps:
+    for level in levels:
+      s = level['steps'].get(step)
+      if s is not None:
+        lines.append('{:<24}{:>6}{:>8}{:>10.0f}{:>10.0f}{:>10.0f}'.format(
+            step, level['concurrency'], s['count'], s['p50_ms'], s['p90_ms'], s['p99_ms']))
+  return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure the ERS latency under increasing load.')
+  parser.add_argument('--levels', type=int, nargs='+', default=[1, 2, 4, 8],
+                      help='numbers of concurrent browsers')
+  parser.add_argument('--flows', type=int, default=None,
+                      help='flows per level, default twice the concurrency')
+  parser.add_argument('--save', metavar='FILE', help='write the report as JSON')
+  parser.add_argument('test', nargs='?', default='OrderTestCase.test_ticket_order_week_normal_sepa')
+  args = parser.parse_args()
+  test = args.test if args.test.startswith('main.') else 'main.' + args.test
+  levels = []
+  for concurrency in args.levels:
+    logger.info('Running {} with {} concurrent browsers.'.format(test, concurrency))
+    levels.append(run_level(test, concurrency, args.flows or 2 * concurrency))
+    logger.info('Outcomes: {}'.format(levels[-1]['outcomes']))
+  logger.info('Latency by step and concurrency:\n' + format_table(levels))
+  if args.save:
+    with open(os.path.expanduser(args.save), 'w') as f:
+      json.dump(dict(test=test, levels=levels), f, indent=1, sort_keys=True)
+    logger.info('Load test report written to {}.'.format(args.save))
+  sys.exit(0)
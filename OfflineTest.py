@@ -0,0 +1,111 @@
+'''
+Created on 18.10.2026
+
+Tests of the flow logic and of the image recognition which run without a browser or display,
+on scripted interfaces and synthetic screens::
+
+    python -m unittest OfflineTest
+'''
+
+import unittest
+import numpy as np
+import Benchmark
+from Prefilter import Prefilter
+from ClientInterface import ClientInterface, Timeout
+from ERSClientInterface import ERSClientInterface
+
+
+class ScriptedSite(ERSClientInterface):
+  """An :class:`ERSClientInterface.ERSClientInterface` on a blank screen whose clicks are only
+  recorded. Clicking one of ``failures`` raises :class:`ClientInterface.Timeout` once, the
+  templates ``visible`` are on the screen and ``page`` is the page shown.
+  """
+
+  def __init__(self, failures=(), visible=(), page='payment'):
+    ClientInterface.__init__(self, capture=Benchmark.StaticBackend(np.zeros((600, 800, 3), np.uint8)))
+    self.imagedirs = [Benchmark.imagedir]
+    self._plan_depth = 0
+    self.retries = 0
+    self.failures = list(failures)
+    self.visible = set(visible)
+    self.page = page
+    self.clicks = []
+
+  def _init_gui(self):
+    pass
+
+  def expected_region(self, name):
+    return None
+
+  def current_page(self, *args, **kwargs):
+    return self.page
+
+  def isvisible(self, im, **kwargs):
+    return im in self.visible
+
+  def whichvisible(self, ims, **kwargs):
+    return [im for im in ims if im in self.visible]
+
+  def clickto(self, point, *args, **kwargs):
+    self.clicks.append(point)
+    if point in self.failures:
+      self.failures.remove(point)
+      raise Timeout('Timeout beim Warten auf Steuerelement: ' + point)
+
+  def select_week_ticket(self, **kwargs):
+    self.clicks.append('select_week_ticket')
+
+
+class PlanTestCase(unittest.TestCase):
+
+  def test_resume_after_payment_chosen(self):
+    site = ScriptedSite(failures=['i_accept'], visible=['i_accept', 'empty_radio_button', 'amount_180',
+                                                       'buy_now', 'sepa_success'])
+    site.retries = 2
+    self.assertTrue(site.order_ticket(ticket='week', age='normal', payment='sepa'))
+    # the second attempt starts after the checkpoint payment_chosen, not at the shopping cart
+    self.assertEqual(site.clicks[-4:], ['save_and_continue', 'i_accept', 'i_accept', 'buy_now'])
+    self.assertEqual(site.clicks.count('continue'), 1)
+
+  def test_resume_in_pay(self):
+    site = ScriptedSite(failures=['buy_now'], visible=['i_accept', 'empty_radio_button', 'amount_180',
+                                                      'buy_now', 'sepa_success'])
+    site.retries = 1
+    self.assertTrue(site.order_ticket(ticket='week', age='normal', payment='sepa'))
+    self.assertEqual(site.clicks[-3:], ['i_accept', 'buy_now', 'buy_now'])
+
+  def test_no_retries(self):
+    site = ScriptedSite(failures=['i_accept'], visible=['i_accept', 'empty_radio_button'])
+    self.assertRaises(Timeout, site.order_ticket, ticket='week', age='normal', payment='sepa')
+
+
+class PrefilterTestCase(unittest.TestCase):
+
+  def setUp(self):
+    # a faint, noisy copy of a template on a flat page, found with a confidence just above 0.8
+    template = Benchmark.load_templates()['help']
+    rs = np.random.RandomState(0)
+    faint = template * 0.1 + 200 + rs.normal(0, 1.4, template.shape)
+    self.screen = np.full((600, 800, 3), 245, np.uint8)
+    self.screen[300:300 + template.shape[0], 400:400 + template.shape[1]] = faint.clip(0, 255).astype(np.uint8)
+    self.expected = Benchmark.BenchmarkInterface(self.screen).match('help', conf=0.8)
+
+  def test_keeps_match_near_threshold(self):
+    self.assertEqual(len(self.expected), 1)
+    self.assertLess(self.expected[0].conf, 0.85)
+    ci = Benchmark.BenchmarkInterface(self.screen)
+    ci.prefilter = Prefilter()
+    found = ci.match('help', conf=0.8)
+    self.assertEqual([m.point for m in found], [m.point for m in self.expected])
+    self.assertAlmostEqual(found[0].conf, self.expected[0].conf, places=3)
+    # the flat page around it is not correlated
+    self.assertLess(ci.prefilter.correlated, ci.prefilter.positions / 2)
+
+  def test_signature_is_approximate(self):
+    ci = Benchmark.BenchmarkInterface(self.screen)
+    ci.prefilter = Prefilter(coverage=0.7)
+    self.assertEqual(ci.match('help', conf=0.8), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
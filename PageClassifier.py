@@ -0,0 +1,170 @@
+'''
+Created on 18.10.2026
+
+Recognise the current page of a site by a fingerprint of the whole browser area, instead of
+probing for one template after the other.
+
+A fingerprint is a small, contrast normalised grayscale thumbnail. The classifier keeps a few
+fingerprints of every known page, learned from test runs or recordings, which are labelled
+with confirmation templates: a page is confirmed if any of its templates is visible. Learn from
+recordings with::
+
+    python PageClassifier.py ~/recordings/20261018-120000-4711-0 [...]
+'''
+
+import os
+import sys
+import json
+import logging
+import threading
+import numpy as np
+import cv2
+from ClientInterface import Frame, BBox
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+
+def fingerprint(image, size=(32, 24)):
+  """:returns: The fingerprint of the grayscale ``image``: a ``size`` thumbnail with zero mean and
+    unit variance.
+  :rtype: :class:`numpy.ndarray`
+  """
+  thumbnail = cv2.resize(image, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+  thumbnail -= thumbnail.mean()
+  return thumbnail / max(float(thumbnail.std()), 1.)
+
+
+class PageClassifier(object):
+  """Fingerprints of known pages, persisted in a JSON file separately for every ``key`` (the
+  screen layout, as for :class:`ClientInterface.LocationPriors`).
+
+  :param filename: The JSON file.
+  :type filename: str
+  :param key: The screen layout.
+  :type key: str
+  :param pages: The confirmation templates of every page, by page name.
+  :type pages: dict
+  :param threshold: Minimum correlation between a fingerprint and a stored one to recognise a page.
+  :type threshold: float
+  :param exemplars: Maximum number of fingerprints stored per page.
+  :type exemplars: int
+  """
+  _instances = {}
+
+  def __init__(self, filename, key, pages, threshold=0.9, exemplars=10):
+    self.filename = filename
+    self.key = key
+    self.pages = pages
+    self.threshold = threshold
+    self.exemplars = exemplars
+    self._lock = threading.Lock()
+    try:
+      with open(filename) as f:
+        self._data = json.load(f)
+    except (IOError, ValueError):
+      self._data = {}
+    self.fingerprints = dict((page, [np.array(f, np.float32) for f in fingerprints])
+                             for page, fingerprints in self._data.get(key, {}).items())
+
+  @classmethod
+  def load(cls, filename, key, pages, **kwargs):
+    """:returns: The shared instance for ``filename`` and ``key``."""
+    if (filename, key) not in cls._instances:
+      cls._instances[(filename, key)] = cls(filename, key, pages, **kwargs)
+    return cls._instances[(filename, key)]
+
+  def classify(self, image):
+    """:returns: The page whose stored fingerprints are most similar to the grayscale ``image``
+      and the correlation, or ``(None, correlation)`` if no page is similar enough.
+    """
+    f = fingerprint(image)
+    best = (None, -1.)
+    with self._lock:
+      for page, fingerprints in self.fingerprints.items():
+        for g in fingerprints:
+          if g.shape == f.shape:
+            correlation = float((f * g).mean())
+            if correlation > best[1]:
+              best = (page, correlation)
+    return best if best[1] >= self.threshold else (None, best[1])
+
+  def learn(self, page, image, save=True):
+    """Store the fingerprint of ``image`` for ``page``, unless a very similar one is stored
+    already. The oldest fingerprint is dropped if there are more than :attr:`exemplars`.
+    """
+    f = fingerprint(image)
+    with self._lock:
+      fingerprints = self.fingerprints.setdefault(page, [])
+      if any(g.shape == f.shape and (f * g).mean() > 0.99 for g in fingerprints):
+        return
+      fingerprints.append(f)
+      del fingerprints[:-self.exemplars]
+    if save:
+      self.save()
+
+  def label(self, ci, frame, bbox=None):
+    """:returns: The pages confirmed by their templates in ``frame``, searched inside ``bbox``.
+    :rtype: list
+    """
+    templates = sorted(set(t for ts in self.pages.values() for t in ts))
+    found = ci.match_many(templates, source=frame, bbox=bbox)
+    return [page for page, ts in self.pages.items() if any(found[t] for t in ts)]
+
+  def learn_recording(self, ci, recording, bbox):
+    """Learn the fingerprints of all frames of ``recording`` which contain ``bbox`` and show
+    exactly one confirmed page.
+
+    :param ci: The interface used to match the confirmation templates.
+    :type ci: :class:`ClientInterface.ClientInterface`
+    :returns: The number of frames learned, by page.
+    :rtype: dict
+    """
+    counts = {}
+    with open(os.path.join(recording, 'events.jsonl')) as f:
+      for line in f:
+        event = json.loads(line)
+        if event['type'] == 'start':
+          # the part of bbox on the screen
+          (width, height) = event['size']
+          bbox = BBox(max(bbox[0], 0), max(bbox[1], 0), min(bbox[2], width - 1), min(bbox[3], height - 1))
+        if event['type'] != 'frame':
+          continue
+        offset = BBox(*event['bbox'])
+        image = cv2.imread(os.path.join(recording, event['file']), cv2.IMREAD_COLOR)
+        frame = Frame(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), offset)
+        if not frame.contains(bbox):
+          continue
+        pages = self.label(ci, frame, bbox)
+        if len(pages) == 1:
+          self.learn(pages[0], frame.region(bbox)[0], save=False)
+          counts[pages[0]] = counts.get(pages[0], 0) + 1
+    self.save()
+    return counts
+
+  def save(self):
+    with self._lock:
+      self._data[self.key] = dict((page, [f.round(3).tolist() for f in fingerprints])
+                                  for page, fingerprints in self.fingerprints.items())
+      try:
+        with open(self.filename, 'w') as f:
+          json.dump(self._data, f, sort_keys=True)
+      except IOError as e:
+        logger.warning('Could not save page fingerprints: {}'.format(e))
+
+
+if __name__ == '__main__':
+  from Replay import replay_interface
+  if len(sys.argv) < 2:
+    sys.exit(__doc__)
+  for recording in sys.argv[1:]:
+    ci = replay_interface(recording)
+    counts = ci.page_classifier.learn_recording(ci, recording, ci.global_bbox)
+    logger.info('{}: learned {}.'.format(recording, ', '.join(
+        '{} {}'.format(page, n) for page, n in sorted(counts.items())) or 'nothing'))
+  sys.exit(0)
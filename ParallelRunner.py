@@ -0,0 +1,261 @@
+'''
+Created on 18.10.2026
+
+Run the tests of :mod:`main` in parallel, each worker on its own Xvfb display with its
+own browser instance.
+
+Usage::
+
+    python ParallelRunner.py [-n WORKERS] [OrderTestCase.test_name ...]
+'''
+
+import os
+import sys
+import time
+import json
+import shutil
+import signal
+import logging
+import argparse
+import tempfile
+import subprocess
+import traceback
+import unittest
+import multiprocessing
+import Latency
+try:
+  from Queue import Empty
+except ImportError:
+  from queue import Empty
+from ERSClientInterface import ERSClientInterface, config_file
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+default_duration = 120.
+
+
+class _RemoteTest(object):
+  """Stands in for a test which was run in a worker process when the results are reported.
+  """
+
+  def __init__(self, test_id):
+    self._id = test_id
+
+  def id(self):
+    return self._id
+
+  def shortDescription(self):
+    return None
+
+  def __str__(self):
+    (cls, method) = self._id.rsplit('.', 1)
+    return '{} ({})'.format(method, cls)
+
+
+def load_durations(filename):
+  try:
+    with open(filename) as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return {}
+
+
+def save_durations(filename, durations):
+  try:
+    with open(filename, 'w') as f:
+      json.dump(durations, f, indent=1, sort_keys=True)
+  except IOError as e:
+    logger.warning('Could not save test durations: {}'.format(e))
+
+
+def shard(tests, workers, durations):
+  """Distribute ``tests`` on ``workers`` shards with similar total duration (longest tests first,
+  each to the shard with the least work so far). Tests without a recorded duration are assumed
+  to take as long as the average test.
+
+  :returns: A list of lists of test ids.
+  """
+  known = [durations[t] for t in tests if t in durations]
+  guess = sum(known) / len(known) if known else default_duration
+  shards = [[] for _ in range(workers)]
+  load = [0.] * workers
+  for t in sorted(tests, key=lambda t: durations.get(t, guess), reverse=True):
+    i = load.index(min(load))
+    shards[i].append(t)
+    load[i] += durations.get(t, guess)
+  return shards
+
+
+def _start_display(config, display, fbdir, processes):
+  """Start Xvfb and the browser on ``display``. The started processes are inserted into
+  ``processes`` at once, so the caller can stop them if starting the next one fails.
+
+  :returns: ``processes`` and the temporary browser profile directory.
+  """
+  cmd = ['Xvfb', display, '-screen', '0', config.get('Parallel', 'screen'), '-nolisten', 'tcp']
+  if fbdir:
+    cmd += ['-fbdir', fbdir]
+  processes.insert(0, subprocess.Popen(cmd))
+  time.sleep(1)
+  profile = tempfile.mkdtemp(prefix='ers-browser-')
+  env = dict(os.environ, DISPLAY=display)
+  browser_cmd = config.get('Parallel', 'browser').format(profile=profile, url=config.get('Parallel', 'url'))
+  try:
+    processes.insert(0, subprocess.Popen(browser_cmd.split(), env=env))
+  except Exception:
+    shutil.rmtree(profile, ignore_errors=True)
+    raise
+  return processes, profile
+
+
+def _worker(index, tests, queue):
+  config = ERSClientInterface.config_parser(config_file)
+  display = ':{}'.format(config.getint('Parallel', 'first_display') + index)
+  fbdir = None
+  processes, profile = [], None
+  try:
+    if config.get('Config', 'capture') == 'xvfb':
+      fbdir = tempfile.mkdtemp(prefix='ers-fb-')
+    processes, profile = _start_display(config, display, fbdir, processes)
+    # ERSClientInterface picks these up in place of the config file values
+    os.environ['ERSTESTSUITE_DISPLAY'] = display
+    if fbdir:
+      os.environ['ERSTESTSUITE_FBDIR'] = fbdir
+    logger.info('Worker {} on display {}: waiting {} seconds for the browser.'.format(
+        index, display, config.get('Parallel', 'startup')))
+    time.sleep(config.getfloat('Parallel', 'startup'))
+    for test_id in tests:
+      start = time.time()
+      result = unittest.TestResult()
+      try:
+        unittest.defaultTestLoader.loadTestsFromName(test_id).run(result)
+      except Exception:
+        result.errors.append((None, traceback.format_exc()))
+      outcome, details = 'success', None
+      if result.errors:
+        outcome, details = 'error', result.errors[0][1]
+      elif result.failures:
+        outcome, details = 'failure', result.failures[0][1]
+      elif result.skipped:
+        outcome, details = 'skipped', result.skipped[0][1]
+      queue.put(dict(id=test_id, outcome=outcome, details=details, duration=time.time() - start,
+                     worker=index))
+  except Exception:
+    logger.error('Worker {} failed:\n{}'.format(index, traceback.format_exc()))
+    raise
+  finally:
+    for p in processes:
+      p.send_signal(signal.SIGTERM)
+      p.wait()
+    if profile:
+      shutil.rmtree(profile, ignore_errors=True)
+    if fbdir:
+      shutil.rmtree(fbdir, ignore_errors=True)
+    if Latency.recorder.enabled:
+      queue.put(dict(latency=Latency.recorder.to_dict(), worker=index))
+    queue.put(None)
+
+
+def messages(processes, queue, poll=1.):
+  """Yield the results sent by the worker ``processes`` through ``queue`` until every worker
+  has finished or died.
+  """
+  running = len(processes)
+  while running:
+    try:
+      r = queue.get(timeout=poll)
+    except Empty:
+      if not any(p.is_alive() for p in processes):
+        # the remaining workers died without saying goodbye, their queue is drained
+        break
+      continue
+    if r is None:
+      running -= 1
+    else:
+      yield r
+  for p in processes:
+    p.join()
+    if p.exitcode:
+      logger.error('Worker process {} exited with code {}.'.format(p.name, p.exitcode))
+
+
+def run(tests, workers, stream=sys.stderr):
+  """Run ``tests`` (ids like ``main.OrderTestCase.test_two_weektickets``) on ``workers``
+  displays and report the merged results like :class:`unittest.TextTestRunner`.
+
+  :returns: The merged result.
+  :rtype: :class:`unittest.TestResult`
+  """
+  basedir = ERSClientInterface.config_parser(config_file).get('Config', 'basedir')
+  durations_file = os.path.join(basedir, 'durations.json')
+  durations = load_durations(durations_file)
+  shards = [s for s in shard(tests, workers, durations) if s]
+  queue = multiprocessing.Queue()
+  processes = [multiprocessing.Process(target=_worker, args=(i, s, queue)) for i, s in enumerate(shards)]
+  start = time.time()
+  for p in processes:
+    p.start()
+  result = unittest.TextTestResult(unittest.runner._WritelnDecorator(stream), True, 1)
+  reported = set()
+  for r in messages(processes, queue):
+    if 'latency' in r:
+      Latency.enable().merge(r['latency'])
+      continue
+    reported.add(r['id'])
+    test = _RemoteTest(r['id'])
+    result.testsRun += 1
+    if r['outcome'] == 'success':
+      durations[r['id']] = r['duration']
+      stream.write('.')
+    elif r['outcome'] == 'failure':
+      result.failures.append((test, r['details']))
+      stream.write('F')
+    elif r['outcome'] == 'error':
+      result.errors.append((test, r['details']))
+      stream.write('E')
+    else:
+      result.skipped.append((test, r['details']))
+      stream.write('s')
+    stream.flush()
+  for i, s in enumerate(shards):
+    for test_id in s:
+      if test_id not in reported:
+        result.testsRun += 1
+        result.errors.append((_RemoteTest(test_id), 'Worker {} died before reporting this test.\n'.format(i)))
+        stream.write('E')
+  elapsed = time.time() - start
+  save_durations(durations_file, durations)
+  stream.write('\n')
+  result.printErrors()
+  stream.write('-' * 70 + '\n')
+  stream.write('Ran {} test{} in {:.3f}s on {} displays\n\n'.format(
+      result.testsRun, '' if result.testsRun == 1 else 's', elapsed, len(shards)))
+  if result.wasSuccessful():
+    stream.write('OK\n')
+  else:
+    stream.write('FAILED (failures={}, errors={})\n'.format(len(result.failures), len(result.errors)))
+  return result
+
+
+if __name__ == '__main__':
+  import main
+  config = ERSClientInterface.config_parser(config_file)
+  parser = argparse.ArgumentParser(description='Run the ERS test suite on several Xvfb displays.')
+  parser.add_argument('-n', '--workers', type=int, default=config.getint('Parallel', 'workers'))
+  parser.add_argument('tests', nargs='*', help='tests like OrderTestCase.test_two_weektickets, default all')
+  args = parser.parse_args()
+  tests = args.tests or ['OrderTestCase.' + name for name in
+                         unittest.defaultTestLoader.getTestCaseNames(main.OrderTestCase)]
+  tests = ['main.' + t if not t.startswith('main.') else t for t in tests]
+  result = run(tests, args.workers)
+  if Latency.recorder.enabled:
+    filename = os.path.expanduser(config.get('Config', 'latency'))
+    Latency.recorder.save(filename)
+    logger.info('Latency report written to {}.'.format(filename))
+  sys.exit(not result.wasSuccessful())
@@ -0,0 +1,215 @@
+'''
+Created on 18.10.2026
+
+A cheap prefilter for template matching: most searches are negative probes, so rule out
+frames and regions which cannot contain the template before running the exact correlation.
+
+Two tests are applied:
+
+* contrast: the correlation coefficient of a window without any contrast is 0 (see
+  ``cv2.matchTemplate``), it cannot reach a positive confidence. Windows whose pixels all have
+  the same value (from the maximum and minimum filtered image, in exact integer arithmetic) are
+  skipped, the correlation is only computed on tiles with other windows. With ``contrast`` above
+  0, windows whose standard deviation (from box filtered sums of the pixels and of their squares)
+  is below this fraction of the template's are skipped as well;
+* signature, only with ``coverage`` above 0: a coarse colour histogram of the template must be
+  covered to this part by the histogram of the searched region, otherwise the whole search is
+  rejected.
+
+With the defaults, the prefilter is exact: it never drops a match with a positive confidence.
+The ``contrast`` and ``coverage`` tests are approximations, the correlation coefficient does not
+change with the brightness and contrast of a window, so a template rendered in other colours or
+with lower contrast is not found anymore.
+
+On busy screens few windows are flat and the contrast test costs more than it saves. It is
+therefore preceded by a coarse bound: the range of a window (and a quarter of its square, its
+maximum variance) is bounded by the extremes of the blocks of :attr:`Prefilter.block` pixels the
+window overlaps. If too many blocks may contain windows with enough contrast, the full correlation
+map is computed right away.
+'''
+
+import weakref
+import threading
+import numpy as np
+import cv2
+
+
+def signature(image, bins=4):
+  """:returns: The colour histogram of the RGB ``image`` with ``bins`` bins per channel, as
+    pixel counts.
+  :rtype: :class:`numpy.ndarray`
+  """
+  image = np.ascontiguousarray(image[:, :, :3])
+  return cv2.calcHist([image], [0, 1, 2], None, [bins] * 3, [0, 256] * 3).ravel()
+
+
+def coverage(region, template):
+  """:returns: The fraction of the pixels of the template signature ``template`` which have
+    a counterpart of the same colour in the signature ``region``.
+  """
+  total = template.sum()
+  return float(np.minimum(region, template).sum() / total) if total else 1.
+
+
+class Prefilter(object):
+  """Rejects searches and regions before the correlation, see the module documentation.
+
+  :param coverage: Minimum :func:`coverage` of the template signature by the searched region, 0
+    to skip the signature test.
+  :type coverage: float
+  :param contrast: Minimum standard deviation of a window, relative to the template's, 0 to only
+    skip windows without contrast.
+  :type contrast: float
+  :param tile: Size of the tiles the correlation map is split into for the contrast test.
+  :type tile: int
+  :param max_fraction: If more than this fraction of the correlation map survives the contrast
+    test, it is computed in one piece.
+  :type max_fraction: float
+  :param bins: Number of bins per channel of the signatures.
+  :type bins: int
+  :param subsample: The signature of the searched region is computed on every ``subsample``-th
+    pixel in both directions.
+  :type subsample: int
+  :param block: Size of the blocks of the coarse contrast bound.
+  :type block: int
+  """
+
+  def __init__(self, coverage=0., contrast=0., tile=64, max_fraction=0.6, bins=4, subsample=2, block=8):
+    self.coverage = coverage
+    self.contrast = contrast
+    self.tile = tile
+    self.max_fraction = max_fraction
+    self.bins = bins
+    self.subsample = subsample
+    self.block = block
+    self._lock = threading.Lock()
+    self._signatures = weakref.WeakKeyDictionary()
+    self.searches = 0
+    self.rejected = dict(signature=0, contrast=0)
+    self.positions = 0
+    self.correlated = 0
+
+  def _region_signature(self, frame, bbox, image):
+    """The signature of ``image``, the part of ``frame`` inside ``bbox``. The signatures are
+    kept as long as the frame, probes for several templates on one frame compute them only once.
+    """
+    key = tuple(bbox) if bbox is not None else None
+    r = None
+    if frame is not None:
+      with self._lock:
+        r = self._signatures.get(frame, {}).get(key)
+    if r is None:
+      step = self.subsample
+      if step > 1 and image.shape[0] * image.shape[1] > 256 * 256:
+        # only large regions, whose counts are still representative when subsampled
+        small = cv2.resize(image, ((image.shape[1] + step - 1) // step, (image.shape[0] + step - 1) // step),
+                           interpolation=cv2.INTER_NEAREST)
+        r = signature(small, self.bins) * (image.shape[0] * image.shape[1] / float(small.shape[0] * small.shape[1]))
+      else:
+        r = signature(image, self.bins)
+      if frame is None:
+        return r
+      with self._lock:
+        self._signatures.setdefault(frame, {})[key] = r
+    return r
+
+  def check_signature(self, template_signature, image, frame=None, bbox=None):
+    """:returns: ``False`` if the RGB ``image`` cannot contain a template with the signature
+      ``template_signature``, always ``True`` if :attr:`coverage` is 0.
+    """
+    if self.coverage <= 0:
+      return True
+    region = self._region_signature(frame, bbox, image)
+    return coverage(region, template_signature) >= self.coverage
+
+  def candidates(self, source, template, stats, context):
+    """Apply the contrast test to all windows of the grayscale ``source``.
+
+    :param stats: The :func:`TemplateBundle.stats` of ``template``.
+    :param context: The :class:`ClientInterface.MatchContext` providing the buffers.
+    :returns: ``None`` if the full correlation map should be computed, otherwise a list of
+      ``(y1, y2, x1, x2)`` ranges of the correlation map which have to be computed (empty if
+      the template cannot be in ``source``).
+    """
+    (t_height, t_width) = template.shape[:2]
+    (s_height, s_width) = source.shape[:2]
+    shape = (s_height - t_height + 1, s_width - t_width + 1)
+    n = t_height * t_width
+    threshold = (self.contrast * stats['norm']) ** 2 / n
+    if stats['norm'] <= 0 or self._busy(source, (t_height, t_width), shape, threshold):
+      return None
+    if threshold > 0:
+      # window means and mean squares, anchored at the upper left corner of the windows
+      kwargs = dict(anchor=(0, 0), normalize=True, borderType=cv2.BORDER_CONSTANT)
+      mean = cv2.boxFilter(source, cv2.CV_32F, (t_width, t_height),
+                           dst=context.buffer('window_mean', (s_height, s_width), np.float32), **kwargs)
+      variance = cv2.sqrBoxFilter(source, cv2.CV_32F, (t_width, t_height),
+                                  dst=context.buffer('window_variance', (s_height, s_width), np.float32), **kwargs)
+      mean = mean[:shape[0], :shape[1]]
+      variance = variance[:shape[0], :shape[1]]
+      np.multiply(mean, mean, out=mean)
+      np.subtract(variance, mean, out=variance)
+      mask = np.greater_equal(variance, threshold, out=context.buffer('window_mask', shape, bool))
+    else:
+      # maximum and minimum of the windows, anchored at their upper left corner
+      kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (t_width, t_height))
+      high = cv2.dilate(source, kernel, dst=context.buffer('window_max', (s_height, s_width)), anchor=(0, 0))
+      low = cv2.erode(source, kernel, dst=context.buffer('window_min', (s_height, s_width)), anchor=(0, 0))
+      mask = np.not_equal(high[:shape[0], :shape[1]], low[:shape[0], :shape[1]],
+                          out=context.buffer('window_mask', shape, bool))
+    tile = self.tile
+    ranges = []
+    surviving = 0
+    starts = np.arange(0, shape[1], tile)
+    for y1 in range(0, shape[0], tile):
+      y2 = min(y1 + tile, shape[0])
+      columns = np.logical_or.reduceat(mask[y1:y2].any(axis=0), starts)
+      x1 = None
+      for i, alive in enumerate(columns.tolist() + [False]):
+        if alive and x1 is None:
+          x1 = starts[i]
+        elif not alive and x1 is not None:
+          x2 = min(starts[i], shape[1]) if i < len(starts) else shape[1]
+          ranges.append((y1, y2, int(x1), int(x2)))
+          surviving += (y2 - y1) * (x2 - x1)
+          x1 = None
+    if surviving > self.max_fraction * shape[0] * shape[1]:
+      return None
+    return ranges
+
+  def _busy(self, source, t_shape, shape, threshold):
+    """:returns: ``True`` if windows with contrast and a variance of at least ``threshold`` may be at more than
+      :attr:`max_fraction` of the ``shape`` positions, by the coarse bound of the module documentation.
+    """
+    b = self.block
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (b, b))
+    # extremes of the blocks of b x b pixels
+    high = cv2.dilate(source, kernel, anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)[::b, ::b]
+    low = cv2.erode(source, kernel, anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)[::b, ::b]
+    # the windows anchored in one block overlap at most these many blocks in each direction
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, ((t_shape[1] + b - 2) // b + 1, (t_shape[0] + b - 2) // b + 1))
+    high = cv2.dilate(high, kernel, anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)
+    low = cv2.erode(low, kernel, anchor=(0, 0), borderType=cv2.BORDER_REPLICATE)
+    spread = cv2.subtract(high, low)[:(shape[0] + b - 1) // b, :(shape[1] + b - 1) // b]
+    alive = np.count_nonzero((spread > 0) & (spread.astype(np.float32) ** 2 >= 4 * threshold))
+    return alive * b * b > self.max_fraction * shape[0] * shape[1]
+
+  def record(self, rejected, positions, correlated):
+    """Count a search with ``positions`` windows which was ``rejected`` by a test (or ``None``),
+    ``correlated`` windows were correlated.
+    """
+    with self._lock:
+      self.searches += 1
+      if rejected is not None:
+        self.rejected[rejected] += 1
+      self.positions += positions
+      self.correlated += correlated
+
+  def summary(self):
+    with self._lock:
+      if not self.searches:
+        return 'no searches'
+      return '{} searches, {:.0%} rejected by signature, {:.0%} by contrast, {:.0%} of the windows correlated'.format(
+          self.searches, float(self.rejected['signature']) / self.searches,
+          float(self.rejected['contrast']) / self.searches,
+          float(self.correlated) / self.positions if self.positions else 0.)
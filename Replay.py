@@ -0,0 +1,260 @@
+'''
+Created on 18.10.2026
+
+Record the screen and the input of a test run and replay it offline.
+
+A recording is a directory with the file ``events.jsonl`` and the captured frames as PNG
+files. Identical frames are stored only once. Replay serves the recorded frames to
+:func:`ClientInterface.ClientInterface.grab` in the order of the input events, so a flow
+can be re-run without a browser or display, e.g.::
+
+    python Replay.py ~/recordings/20261018-120000-4711-0 main.OrderTestCase.test_two_weektickets
+    python Replay.py ~/recordings/20261018-120000-4711-0 order_two_weektickets
+'''
+
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import itertools
+import threading
+import numpy as np
+import cv2
+from Capture import CaptureBackend
+from ClientInterface import Timeout
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+
+class Recorder(object):
+  """Writes a recording to ``dirname``.
+
+  :param dirname: The recording directory, it is created if necessary.
+  :type dirname: str
+  :param size: Width and height of the screen.
+  """
+  _counter = itertools.count()
+
+  def __init__(self, dirname, size):
+    self.dirname = dirname
+    if not os.path.isdir(dirname):
+      os.makedirs(dirname)
+    self._start = time.time()
+    self._frames = set()
+    # frames are recorded by the capture thread, inputs by the caller
+    self._lock = threading.Lock()
+    self._events = open(os.path.join(dirname, 'events.jsonl'), 'w')
+    self._write(dict(type='start', size=list(size), time=self._start))
+
+  @classmethod
+  def create(cls, basedir, size):
+    """:returns: A recorder writing to a new, uniquely named directory inside ``basedir``."""
+    name = '{}-{}-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(cls._counter))
+    dirname = os.path.join(os.path.expanduser(basedir), name)
+    logger.info('Recording to {}.'.format(dirname))
+    return cls(dirname, size)
+
+  def _write(self, event):
+    with self._lock:
+      self._events.write(json.dumps(event) + '\n')
+      self._events.flush()
+
+  def frame(self, frame):
+    """Record a captured :class:`ClientInterface.Frame`."""
+    rgb = np.ascontiguousarray(frame.array(gray=False))
+    digest = hashlib.sha1(rgb.tobytes()).hexdigest()
+    filename = digest + '.png'
+    if digest not in self._frames:
+      cv2.imwrite(os.path.join(self.dirname, filename), cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+      self._frames.add(digest)
+    self._write(dict(type='frame', t=frame.timestamp - self._start, bbox=list(frame.bbox), file=filename))
+
+  def input(self, kind, *args):
+    """Record an input event."""
+    self._write(dict(type='input', t=time.time() - self._start, kind=kind, args=list(args)))
+
+  def close(self):
+    with self._lock:
+      self._events.close()
+
+
+class ReplayBackend(CaptureBackend):
+  """A capture backend serving the frames of a recording.
+
+  The recording is split into segments at the input events. Every capture applies the next
+  recorded frame of the current segment to a virtual screen and returns the requested region
+  of it. :func:`input` moves on to the next segment, applying frames which were not requested.
+
+  :param dirname: The recording directory.
+  :type dirname: str
+  """
+
+  def __init__(self, dirname):
+    CaptureBackend.__init__(self)
+    self.dirname = dirname
+    self.segments = [[]]
+    self.inputs = []
+    with open(os.path.join(dirname, 'events.jsonl')) as f:
+      for line in f:
+        event = json.loads(line)
+        if event['type'] == 'start':
+          self._size = tuple(event['size'])
+        elif event['type'] == 'frame':
+          self.segments[-1].append(event)
+        elif event['type'] == 'input':
+          self.inputs.append(event)
+          self.segments.append([])
+    self._screen = np.zeros((self._size[1], self._size[0], 3), np.uint8)
+    self._images = {}
+    self._segment = 0
+    self._position = 0
+    self.diverged = 0
+
+  @property
+  def exhausted(self):
+    """``True`` if all frames of the current segment have been served."""
+    return self._position >= len(self.segments[self._segment])
+
+  def size(self):
+    return self._size
+
+  def _image(self, filename):
+    if filename not in self._images:
+      im = cv2.imread(os.path.join(self.dirname, filename), cv2.IMREAD_COLOR)
+      self._images[filename] = cv2.cvtColor(im, cv2.COLOR_BGR2RGB)
+    return self._images[filename]
+
+  def _apply(self, event):
+    (x1, y1, x2, y2) = event['bbox']
+    self._screen[y1:y2 + 1, x1:x2 + 1] = self._image(event['file'])
+
+  def grab(self, bbox=None):
+    if not self.exhausted:
+      self._apply(self.segments[self._segment][self._position])
+      self._position += 1
+    (x, y, width, height) = self.clip(bbox)
+    self.generation += 1
+    return self._screen[y:y + height, x:x + width].copy()
+
+  def input(self, kind, *args):
+    """Advance to the segment after the next recorded input event."""
+    if self._segment >= len(self.inputs):
+      logger.warning('Replay diverged: {} after the end of the recording.'.format(kind))
+      self.diverged += 1
+      return
+    expected = self.inputs[self._segment]
+    if expected['kind'] != kind or expected['args'] != json.loads(json.dumps(list(args))):
+      logger.warning('Replay diverged: {}{} instead of recorded {}{}.'.format(
+          kind, tuple(args), expected['kind'], tuple(expected['args'])))
+      self.diverged += 1
+    for event in self.segments[self._segment][self._position:]:
+      self._apply(event)
+    self._segment += 1
+    self._position = 0
+
+
+class ReplayMixin(object):
+  """Mix into a :class:`ClientInterface.ClientInterface` subclass to run it against a
+  recording: screenshots come from a :class:`ReplayBackend`, input is not sent anywhere and
+  all pauses are skipped.
+
+  :param recording: The recording directory.
+  :type recording: str
+  :param max_idle: Number of polls without a new recorded frame after which a wait is aborted
+    with :class:`ClientInterface.Timeout`.
+  :type max_idle: int
+  """
+
+  def __init__(self, recording, *args, **kwargs):
+    self.max_idle = kwargs.pop('max_idle', 100)
+    self._idle = 0
+    kwargs['capture'] = ReplayBackend(recording)
+    super(ReplayMixin, self).__init__(*args, **kwargs)
+    # adaptive pacing and background captures would consume recorded frames
+    self.pacing = 'fixed'
+    self.threaded_capture = False
+
+  def _init_gui(self):
+    pass
+
+  def _input_event(self, kind, *args):
+    super(ReplayMixin, self)._input_event(kind, *args)
+    self.capture.input(kind, *args)
+    self._idle = 0
+
+  def _sleep(self, s):
+    if self.capture.exhausted:
+      self._idle += 1
+      if self._idle > self.max_idle:
+        raise Timeout('Replay: no more recorded frames.')
+
+  def size(self):
+    return self.capture.size()
+
+  def getpos(self, offset=None):
+    raise NotImplementedError('The mouse position is not recorded.')
+
+  def _moveto(self, point, **kwargs):
+    pass
+
+  def _mousedown(self, s=None):
+    self._input_event('mousedown')
+
+  def _mouseup(self, s=None):
+    self._input_event('mouseup')
+
+  def _click(self, **kwargs):
+    self._input_event('click')
+
+  def keypress(self, i, s=None, modifier=None):
+    self._input_event('keypress', i, modifier)
+
+  def type_string(self, s, **kwargs):
+    self._input_event('type_string', s)
+
+  def key_sequence(self, keys, s=None):
+    self._input_event('key_sequence', [str(k) for k in keys])
+
+  def paste_string(self, s, **kwargs):
+    self._input_event('paste_string', s)
+
+  def _drag(self, point1, point2, **kwargs):
+    self._input_event('drag', point2)
+
+
+def replay_interface(recording, base=None):
+  """:returns: An interface of class ``base`` (default :class:`ERSClientInterface.ERSClientInterface`)
+  which replays ``recording``.
+  """
+  if base is None:
+    from ERSClientInterface import ERSClientInterface as base
+  cls = type('Replay' + base.__name__, (ReplayMixin, base), {})
+  return cls(recording)
+
+
+if __name__ == '__main__':
+  import unittest
+  if len(sys.argv) != 3:
+    sys.exit(__doc__)
+  (recording, name) = sys.argv[1:]
+  start = time.time()
+  if '.' in name:
+    # a test id: let the test case construct replay interfaces
+    import main
+    main.OrderTestCase.interface = staticmethod(lambda: replay_interface(recording))
+    result = unittest.TextTestRunner().run(unittest.defaultTestLoader.loadTestsFromName(name))
+    ok = result.wasSuccessful()
+  else:
+    ci = replay_interface(recording)
+    ok = getattr(ci, name)()
+    logger.info('{} returned {}, {} divergences from the recording.'.format(name, ok, ci.capture.diverged))
+  logger.info('Replay took {:.2f} seconds.'.format(time.time() - start))
+  sys.exit(not ok)
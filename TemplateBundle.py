@@ -0,0 +1,207 @@
+'''
+Created on 18.10.2026
+
+A bundle of precompiled templates: the decoded color and grayscale arrays and the grayscale
+pyramid of every template in a set of image directories, together with their mean and norm,
+in one file which is memory-mapped, so that all processes on a host share the same pages.
+
+The bundle is rebuilt when a PNG in one of the directories is added, removed or changed.
+Build it explicitly with::
+
+    python TemplateBundle.py
+'''
+
+import os
+import sys
+import json
+import glob
+import struct
+import logging
+import numpy as np
+import cv2
+
+# Setup logger for this module
+logger = logging.getLogger(__name__)
+handler = logging.StreamHandler()
+handler.setFormatter(logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s'))
+logger.setLevel(logging.DEBUG)
+logger.handlers = [handler]
+logger.propagate = False
+
+magic = b'ERSTPL1\n'
+alignment = 64
+
+
+def decode(path):
+  """:returns: The color and grayscale arrays of the PNG file ``path``, as loaded by
+    :class:`ClientInterface.TemplateStore`.
+  :rtype: dict
+  """
+  from PIL import Image
+  im = np.array(Image.open(path, 'r'))
+  return dict(color=im, gray=cv2.cvtColor(im, cv2.COLOR_BGR2GRAY))
+
+
+def pyramid(gray, levels=3, min_size=16):
+  """:returns: ``gray`` and up to ``levels`` successively halved versions of it, as long as the
+    smaller side stays at least ``min_size`` pixels.
+  """
+  r = [gray]
+  while len(r) <= levels and min(r[-1].shape[:2]) >> 1 >= min_size:
+    r.append(cv2.pyrDown(r[-1]))
+  return r
+
+
+def pyramid_scores(pyramid):
+  """:returns: For every level of ``pyramid``, the lowest correlation of the downscaled template
+    with the template downscaled at any other pixel phase, i.e. how well the coarse template is
+    found at the position of the template on a downscaled screen.
+  :rtype: list
+  """
+  scores = [1.]
+  for level in range(1, len(pyramid)):
+    scale = 1 << level
+    padded = cv2.copyMakeBorder(pyramid[0], scale, scale, scale, scale, cv2.BORDER_REPLICATE)
+    worst = 1.
+    for dy in range(scale):
+      for dx in range(scale):
+        small = padded[dy:, dx:]
+        for _ in range(level):
+          small = cv2.pyrDown(small)
+        if small.shape[0] >= pyramid[level].shape[0] and small.shape[1] >= pyramid[level].shape[1]:
+          worst = min(worst, cv2.minMaxLoc(cv2.matchTemplate(small, pyramid[level], cv2.TM_CCOEFF_NORMED))[1])
+    scores.append(float(worst))
+  return scores
+
+
+def stats(gray):
+  """:returns: The mean and the norm of ``gray`` with the mean subtracted."""
+  g = gray.astype(np.float64)
+  mean = g.mean()
+  return dict(mean=float(mean), norm=float(np.sqrt(((g - mean) ** 2).sum())))
+
+
+def sources(imagedirs):
+  """:returns: The PNG file used for every template name (the first of ``imagedirs`` containing it
+    wins) and its modification time.
+  :rtype: dict
+  """
+  r = {}
+  for d in reversed(imagedirs):
+    for path in glob.glob(os.path.join(d or os.curdir, '*.png')):
+      name = os.path.splitext(os.path.basename(path))[0]
+      r[name] = (os.path.join(d, os.path.basename(path)), os.stat(path).st_mtime)
+  return r
+
+
+def build(filename, imagedirs):
+  """Compile the templates in ``imagedirs`` into the bundle ``filename``. The file is replaced
+  atomically, processes which mapped the old version keep using it.
+  """
+  index = {}
+  chunks = []
+  offset = 0
+  for name, (path, mtime) in sorted(sources(imagedirs).items()):
+    try:
+      entry = decode(path)
+    except Exception as e:
+      logger.warning('Skipping template {}: {}'.format(path, e))
+      continue
+    arrays = dict(color=entry['color'], gray=entry['gray'])
+    for level, im in enumerate(pyramid(entry['gray'])[1:]):
+      arrays['pyramid{}'.format(level + 1)] = im
+    layout = {}
+    for key, a in arrays.items():
+      a = np.ascontiguousarray(a)
+      layout[key] = [offset, list(a.shape), a.dtype.str]
+      data = a.tobytes()
+      chunks.append(data + b'\0' * (-len(data) % alignment))
+      offset += len(chunks[-1])
+    index[name] = dict(path=path, mtime=mtime, arrays=layout, **stats(entry['gray']))
+  header = json.dumps(dict(imagedirs=list(imagedirs), templates=index)).encode('utf-8')
+  start = len(magic) + 8 + len(header)
+  start += -start % alignment
+  tmp = '{}.{}.tmp'.format(filename, os.getpid())
+  with open(tmp, 'wb') as f:
+    f.write(magic + struct.pack('<Q', len(header)) + header)
+    f.write(b'\0' * (start - f.tell()))
+    for chunk in chunks:
+      f.write(chunk)
+  os.rename(tmp, filename)
+  logger.info('Built template bundle {} with {} templates.'.format(filename, len(index)))
+
+
+class TemplateBundle(object):
+  """A memory-mapped template bundle, see :func:`build`.
+
+  :param filename: The bundle file.
+  :type filename: str
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    with open(filename, 'rb') as f:
+      if f.read(len(magic)) != magic:
+        raise IOError('{} is not a template bundle.'.format(filename))
+      (length,) = struct.unpack('<Q', f.read(8))
+      header = json.loads(f.read(length).decode('utf-8'))
+    start = len(magic) + 8 + length
+    start += -start % alignment
+    self.imagedirs = header['imagedirs']
+    self.templates = header['templates']
+    self._data = np.memmap(filename, np.uint8, 'r', offset=start) if self.templates else None
+
+  @classmethod
+  def load(cls, filename, imagedirs):
+    """:returns: The bundle ``filename``, rebuilt first if it was built from other directories or
+      any of their PNG files changed.
+    """
+    try:
+      bundle = cls(filename)
+      if bundle.current(imagedirs):
+        return bundle
+      logger.info('Templates changed, rebuilding {}.'.format(filename))
+    except (IOError, ValueError):
+      pass
+    build(filename, imagedirs)
+    return cls(filename)
+
+  def current(self, imagedirs):
+    """:returns: ``True`` if the bundle is up to date with the PNG files in ``imagedirs``."""
+    if list(imagedirs) != self.imagedirs:
+      return False
+    files = dict((name, (t['path'], t['mtime'])) for name, t in self.templates.items())
+    return files == sources(imagedirs)
+
+  def _array(self, layout):
+    (offset, shape, dtype) = layout
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    return self._data[offset:offset + size].view(dtype).reshape(shape)
+
+  def get(self, name, path=None, mtime=None):
+    """:returns: The entry of template ``name`` with the arrays ``color``, ``gray`` and
+      ``pyramid`` and the stats ``mean`` and ``norm``, or ``None`` if it is not in the bundle or
+      was compiled from another ``path`` or version (``mtime``).
+    :rtype: dict
+    """
+    t = self.templates.get(name)
+    if t is None or (path is not None and t['path'] != path) or (mtime is not None and t['mtime'] != mtime):
+      return None
+    arrays = t['arrays']
+    levels = sorted(int(key[7:]) for key in arrays if key.startswith('pyramid'))
+    gray = self._array(arrays['gray'])
+    return dict(color=self._array(arrays['color']), gray=gray,
+                pyramid=[gray] + [self._array(arrays['pyramid{}'.format(l)]) for l in levels],
+                stats=dict(mean=t['mean'], norm=t['norm']))
+
+
+if __name__ == '__main__':
+  from ERSClientInterface import ERSClientInterface, config_file
+  config = ERSClientInterface.config_parser(config_file)
+  basedir = config.get('Config', 'basedir')
+  if not os.path.isdir(basedir):
+    os.makedirs(basedir)
+  build(os.path.join(basedir, 'templates.bundle'),
+        [os.path.join(basedir, 'images'), os.path.join(config.get('Config', 'packagedir'), 'images')])
+  sys.exit(0)
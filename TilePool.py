@@ -0,0 +1,115 @@
+'''
+Created on 18.10.2026
+
+Template matching on a pool of processes: the correlation map of a large search area is split
+into horizontal bands which are computed in parallel. The searched image is copied once into
+shared memory, the workers read their bands from there without copying and write their part of
+the correlation map into a second shared buffer.
+
+Neighbouring bands overlap by the template height minus one rows of the image. Their heights
+are multiples of the block height OpenCV uses for the DFT based correlation, so every band is
+computed in the same blocks as in a single call. OpenCV's IPP code path uses blocks which depend on
+the size of the whole image instead, so it is switched off in the workers: the map is bit-identical
+to a single call without IPP (see :attr:`ClientInterface.MatchContext.ipp`), but not to the default
+single call with IPP, which is about twice as fast in one process. The confidences of matches above
+0.8 differ from it by less than 1e-4, weak peaks below by up to a few hundredths, so ``mult``
+searches with a low ``conf`` may return other peaks. ``Benchmark.py --processes`` checks that the
+matches agree.
+'''
+
+import ctypes
+import threading
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+import cv2
+
+# the shared buffers of a worker process
+_source = None
+_result = None
+
+
+def set_ipp(enabled):
+  """Switch the IPP code path of OpenCV on or off for the current thread, if OpenCV has it."""
+  ipp = getattr(cv2, 'ipp', None)
+  if ipp is not None:
+    ipp.setUseIPP(enabled)
+
+
+def block_height(rows, t_height):
+  """:returns: The height of the blocks in which OpenCV computes a correlation map with ``rows``
+    rows for a template of height ``t_height`` (see ``crossCorr`` in ``templmatch.cpp``).
+  """
+  height = min(max(int(round(t_height * 4.5)), 256 - t_height + 1), rows)
+  return min(cv2.getOptimalDFTSize(height + t_height - 1) - t_height + 1, rows)
+
+
+def bands(rows, t_height, count):
+  """Split the rows of a correlation map into about ``count`` bands of whole OpenCV blocks.
+
+  :returns: A list of ``(y1, y2)`` row ranges.
+  """
+  block = block_height(rows, t_height)
+  per_band = max(1, -(-(rows // block) // count)) * block
+  r = []
+  y1 = 0
+  while y1 < rows:
+    y2 = y1 + per_band
+    if rows - y2 < block:
+      # a band shorter than a block would be computed in smaller blocks
+      y2 = rows
+    r.append((y1, y2))
+    y1 = y2
+  return r
+
+
+def _init_worker(source, result):
+  global _source, _result
+  (_source, _result) = (source, result)
+  cv2.setNumThreads(1)
+  set_ipp(False)
+
+
+def _correlate_band(shape, template, y1, y2):
+  source = np.frombuffer(_source, np.uint8, count=int(np.prod(shape))).reshape(shape)
+  (t_height, t_width) = template.shape[:2]
+  map_shape = (shape[0] - t_height + 1, shape[1] - t_width + 1)
+  result = np.frombuffer(_result, np.float32, count=map_shape[0] * map_shape[1]).reshape(map_shape)
+  cv2.matchTemplate(source[y1:y2 + t_height - 1], template, cv2.TM_CCOEFF_NORMED, result=result[y1:y2])
+
+
+class TilePool(object):
+  """A pool of ``processes`` worker processes with shared buffers for grayscale or RGB images of
+  up to ``pixels`` pixels.
+  """
+
+  def __init__(self, processes, pixels):
+    self.processes = processes
+    self.pixels = pixels
+    self._source = RawArray(ctypes.c_uint8, 3 * pixels)
+    self._result = RawArray(ctypes.c_float, pixels)
+    self._lock = threading.Lock()
+    self._pool = multiprocessing.Pool(processes, _init_worker, (self._source, self._result))
+
+  def correlate(self, source, template, out):
+    """Compute the normalized correlation coefficient map of ``template`` in ``source`` into
+    ``out``, which must have the shape of the map.
+
+    :returns: ``out``, or ``None`` if ``source`` does not fit into the shared buffer.
+    """
+    if source.dtype != np.uint8 or source.shape[0] * source.shape[1] > self.pixels or source.size > 3 * self.pixels:
+      return None
+    with self._lock:
+      shared = np.frombuffer(self._source, np.uint8, count=source.size).reshape(source.shape)
+      np.copyto(shared, source)
+      template = np.array(template)
+      tasks = [self._pool.apply_async(_correlate_band, (source.shape, template, y1, y2))
+               for (y1, y2) in bands(out.shape[0], template.shape[0], 2 * self.processes)]
+      for task in tasks:
+        task.get()
+      np.copyto(out, np.frombuffer(self._result, np.float32, count=out.size).reshape(out.shape))
+    return out
+
+  def close(self):
+    self._pool.terminate()
+    self._pool.join()
@@ -6,8 +6,13 @@ Created on 23.05.2015
 
 import logging
 import ERSClientInterface
+from ClientInterface import LocationPriors
+import Instrumentation
+import Latency
 import unittest
 import time
+import sys
+import os
 
 # Setup logger for this module
 logger = logging.getLogger(__name__)
@@ -20,10 +25,12 @@ logger.propagate = False
 
 
 class OrderTestCase(unittest.TestCase):
+  interface=ERSClientInterface.ERSClientInterface.shared
   def __init__(self,*args,**kwargs):
     super(OrderTestCase,self).__init__(*args,**kwargs)
-    self.CI=ERSClientInterface.ERSClientInterface()
+    self.CI=self.interface()
   def setUp(self):
+    self.CI.profiler.begin_test(self.id())
     if self.CI.isvisible('logout'):
       self.CI.clickto('logout')
     self.CI.empty_shopping_cart()
@@ -70,4 +77,18 @@ class OrderTestCase(unittest.TestCase):
 if __name__ == '__main__':
   logger.info('Sleeping 10 seconds, please bring the browser with the ERS site loaded to the front.')
   time.sleep(10)
-  unittest.main()
+  program = unittest.main(exit=False)
+  for priors in LocationPriors._instances.values():
+    logger.info('Location priors: ' + priors.summary())
+  interface = ERSClientInterface.ERSClientInterface.__dict__.get('_shared')
+  if interface is not None and interface.prefilter is not None:
+    logger.info('Prefilter: ' + interface.prefilter.summary())
+  if Instrumentation.profiler.enabled:
+    filename = ERSClientInterface.ERSClientInterface.config_parser(ERSClientInterface.config_file).get('Config', 'profile')
+    Instrumentation.profiler.save(os.path.expanduser(filename))
+    logger.info('Timing report written to {}.'.format(filename))
+  if Latency.recorder.enabled:
+    filename = ERSClientInterface.ERSClientInterface.config_parser(ERSClientInterface.config_file).get('Config', 'latency')
+    Latency.recorder.save(os.path.expanduser(filename))
+    logger.info('Latency report written to {}.'.format(filename))
+  sys.exit(not program.result.wasSuccessful())